@@ -4,7 +4,7 @@ from api.flask_app import admin
 from api.config import DEBUG
 from api.models import *
 
-only_read_models = [MQ2Data, DHTData]
+only_read_models = [MQ2Data, DHTData, MQ2Rollup, DHTRollup, Job]
 models = [Device, Case, Log, Report, Notification, Subscriber]
 
 if DEBUG:
@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+
+import numpy as np
+from sqlalchemy import func
+
+from api.downsampling import SENSOR_FIELDS, COLUMN_DTYPES, epoch_seconds, fetch_columns, filter_series, to_epoch
+from api.models import db
+
+# device_id и case_id без значения в архиве
+NO_ID = -1
+
+
+class SensorArchive:
+    """
+    Архив сырых показаний по суткам: <directory>/<таблица>/<ГГГГ-ММ-ДД>/<колонка>.npy,
+    колонки date_time (epoch-секунды int64), device_id, case_id (int32) и поля датчика.
+    Файлы читаются через mmap, в память попадают только нужные страницы.
+    index.json таблицы - заархивированные сутки с числом строк в них и max_id: наибольший id в таблице
+    на момент последней архивации. Все строки заархивированных суток с id не больше max_id лежат в архиве,
+    более новые (дописанные задним числом) читаются из базы и доливаются в архив при следующей архивации
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+        self.manifests = {}
+
+    def table_dir(self, model):
+        return os.path.join(self.directory, model.__tablename__)
+
+    def day_dir(self, model, day):
+        return os.path.join(self.table_dir(model), day.isoformat())
+
+    def dtypes(self, model):
+        fields = SENSOR_FIELDS[model.__name__]
+        return [('date_time', np.int64), ('device_id', np.int32), ('case_id', np.int32)] + \
+               [(field, COLUMN_DTYPES[model.__name__][field]) for field in fields]
+
+    def manifest(self, model):
+        """:return: {'days': Dict[ГГГГ-ММ-ДД, число строк], 'max_id': int}, перечитывается при изменении index.json"""
+        path = os.path.join(self.table_dir(model), 'index.json')
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return {'days': {}, 'max_id': 0}
+        with self.lock:
+            cached = self.manifests.get(model.__tablename__)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path) as f:
+                manifest = json.load(f)
+            self.manifests[model.__tablename__] = (mtime, manifest)
+            return manifest
+
+    def save_manifest(self, model, manifest):
+        path = os.path.join(self.table_dir(model), 'index.json')
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+    def days(self, model, date_from=None, date_to=None):
+        """Заархивированные сутки, пересекающиеся с [date_from, date_to)"""
+        result = []
+        for key in sorted(self.manifest(model)['days']):
+            day = date.fromisoformat(key)
+            start = datetime.combine(day, time())
+            if (date_to is None or start < date_to) and (date_from is None or start + timedelta(days=1) > date_from):
+                result.append(day)
+        return result
+
+    def max_id(self, model):
+        """Строки заархивированных суток с id не больше этого уже лежат в архиве"""
+        return self.manifest(model)['max_id']
+
+    def load(self, model, day, date_from=None, date_to=None, device_id=None):
+        """Колонки одних суток, отфильтрованные по периоду и устройству: Dict[колонка, np.ndarray]"""
+        directory = self.day_dir(model, day)
+        columns = {}
+        for name, dtype in self.dtypes(model):
+            path = os.path.join(directory, f"{name}.npy")
+            columns[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else np.empty(0, dtype=dtype)
+
+        mask = None
+        if date_from is not None:
+            mask = columns['date_time'] >= to_epoch([date_from])[0]
+        if date_to is not None:
+            before = columns['date_time'] < to_epoch([date_to])[0]
+            mask = before if mask is None else mask & before
+        if device_id is not None:
+            device = columns['device_id'] == device_id
+            mask = device if mask is None else mask & device
+        if mask is None:
+            return {name: np.array(column) for name, column in columns.items()}
+        return {name: column[mask] for name, column in columns.items()}
+
+    def fetch_day(self, model, day, after_id, max_id):
+        """Показания суток из базы с after_id < id <= max_id, по времени"""
+        start = datetime.combine(day, time())
+        columns = [epoch_seconds(model.date_time), func.coalesce(model.device_id, NO_ID),
+                   func.coalesce(model.case_id, NO_ID)] + [getattr(model, field)
+                                                           for field in SENSOR_FIELDS[model.__name__]]
+        query = filter_series(db.session.query(*columns), model, start, start + timedelta(days=1))
+        query = query.filter(model.id > after_id, model.id <= max_id)
+        return fetch_columns(query.order_by(model.date_time, model.id), self.dtypes(model))
+
+    def save_day(self, model, day, data):
+        """Записать колонки суток; каталог суток заменяется целиком"""
+        directory = self.day_dir(model, day)
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, column in data.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), column)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+        return len(data['date_time'])
+
+    def archive_day(self, model, day, max_id):
+        """Записать показания суток из базы с id <= max_id в архив. :return: число строк"""
+        return self.save_day(model, day, self.fetch_day(model, day, 0, max_id))
+
+    def merge_day(self, model, day, after_id, max_id):
+        """
+        Долить в архив суток строки базы с after_id < id <= max_id. Строки, уже удалённые из базы
+        политикой хранения, остаются в архиве. :return: число строк в архиве суток
+        """
+        archived = self.load(model, day)
+        fresh = self.fetch_day(model, day, after_id, max_id)
+        data = {name: np.concatenate([archived[name], fresh[name]]) for name, _ in self.dtypes(model)}
+        order = np.argsort(data['date_time'], kind='stable')
+        return self.save_day(model, day, {name: column[order] for name, column in data.items()})
+
+    def stale_days(self, model, after_id):
+        """Сутки (ГГГГ-ММ-ДД), в которых есть строки с id больше after_id"""
+        rows = db.session.query(func.date(model.date_time)) \
+            .filter(model.date_time.isnot(None), model.id > after_id).distinct().all()
+        # SQLite возвращает date() строкой, другие базы - датой
+        return {str(day)[:10] for day, in rows}
+
+    def archive(self, model, before):
+        """
+        Заархивировать все ещё не заархивированные сутки до даты before (не включительно)
+        и долить в уже заархивированные строки, появившиеся в базе после прошлой архивации
+        :return: List[Tuple(сутки, число строк)]
+        """
+        first, max_id = db.session.query(func.min(model.date_time), func.max(model.id)).one()
+        if first is None:
+            return []
+        os.makedirs(self.table_dir(model), exist_ok=True)
+        manifest = self.manifest(model)
+        days = dict(manifest['days'])
+        archived = []
+        if days:
+            for key in sorted(self.stale_days(model, manifest['max_id']) & set(days)):
+                days[key] = self.merge_day(model, date.fromisoformat(key), manifest['max_id'], max_id)
+                archived.append((date.fromisoformat(key), days[key]))
+        day = first.date()
+        while day < before:
+            key = day.isoformat()
+            if key not in days:
+                days[key] = self.archive_day(model, day, max_id)
+                archived.append((day, days[key]))
+            day += timedelta(days=1)
+        if archived or max_id != manifest['max_id']:
+            self.save_manifest(model, {'days': days, 'max_id': max_id})
+        return archived
+
+
+archive = None
+
+
+def get_archive():
+    """:return: SensorArchive или None, если SENSOR_ARCHIVE_DIR не задан"""
+    global archive
+    from api.config import SENSOR_ARCHIVE_DIR
+
+    if archive is None and SENSOR_ARCHIVE_DIR:
+        archive = SensorArchive(SENSOR_ARCHIVE_DIR)
+    return archive
+
+
+def archive_horizon():
+    """Первые сутки, которые ещё не архивируются: сегодня минус SENSOR_ARCHIVE_AFTER_DAYS"""
+    from api.config import SENSOR_ARCHIVE_AFTER_DAYS
+
+    return date.today() - timedelta(days=SENSOR_ARCHIVE_AFTER_DAYS)
+
+
+def archive_readings():
+    """Заархивировать завершённые сутки до archive_horizon() по всем таблицам показаний"""
+    from api.models import MQ2Data, DHTData
+
+    sensor_archive = get_archive()
+    if sensor_archive is None:
+        return {}
+    return {model.__name__: sensor_archive.archive(model, archive_horizon()) for model in (MQ2Data, DHTData)}
@@ -0,0 +1,63 @@
+from threading import Lock
+
+from api.models import MQ2Data, DHTData
+
+# ключ для последней записи по всем устройствам
+ALL_DEVICES = object()
+# ключ ещё не загружен из БД
+MISSING = object()
+
+
+def is_newer(row, other):
+    return (row['date_time'], row['id']) > (other['date_time'], other['id'])
+
+
+class LatestReadingCache:
+    """
+    Write-through кэш последней записи таблицы с показаниями - по каждому устройству и по всем сразу.
+    Промах загружает запись из БД, запись через ingest обновляет уже загруженные ключи.
+    Кэш живёт в памяти процесса.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = Lock()
+        self.entries = {}
+
+    def get(self, device_id=ALL_DEVICES):
+        with self.lock:
+            entry = self.entries.get(device_id, MISSING)
+        if entry is MISSING:
+            entry = self.load(device_id)
+        return entry
+
+    def load(self, device_id=ALL_DEVICES):
+        query = self.model.query
+        if device_id is not ALL_DEVICES:
+            query = query.filter_by(device_id=device_id)
+        obj = query.order_by(self.model.date_time.desc(), self.model.id.desc()).first()
+        row = obj.as_dict() if obj is not None else None
+
+        with self.lock:
+            entry = self.entries.get(device_id, MISSING)
+            if entry is MISSING or entry is None or (row is not None and is_newer(row, entry)):
+                self.entries[device_id] = row
+            return self.entries[device_id]
+
+    def put(self, row):
+        """Обновить кэш только что записанной строкой (dict из as_dict())"""
+        with self.lock:
+            for key in (row['device_id'], ALL_DEVICES):
+                entry = self.entries.get(key, MISSING)
+                if entry is MISSING:
+                    continue
+                if entry is None or entry['id'] == row['id'] or is_newer(row, entry):
+                    self.entries[key] = row
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+mq2_cache = LatestReadingCache(MQ2Data)
+dht_cache = LatestReadingCache(DHTData)
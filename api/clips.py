@@ -0,0 +1,150 @@
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+THUMB_WIDTH = 320
+# не больше одной точки индекса на столько секунд
+INDEX_INTERVAL = 1.0
+
+# контейнеры mp4, внутри которых лежит таблица ключевых кадров moov/trak/mdia/minf/stbl/stss
+CONTAINER_BOXES = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+
+def thumb_path(path):
+    return f"{path}.thumb.jpg"
+
+
+def index_path(path):
+    return f"{path}.index.json"
+
+
+def iter_boxes(f, start, end):
+    """Боксы mp4 в диапазоне файла: Tuple(тип, начало данных, конец бокса)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def video_sync_samples(f, start, end):
+    """Номера ключевых кадров (с 1) первой дорожки, у которой есть stss"""
+    for kind, data_start, box_end in iter_boxes(f, start, end):
+        if kind == b'stss':
+            f.seek(data_start + 4)
+            count = struct.unpack('>I', f.read(4))[0]
+            return list(struct.unpack(f'>{count}I', f.read(4 * count)))
+        if kind in CONTAINER_BOXES:
+            samples = video_sync_samples(f, data_start, box_end)
+            if samples is not None:
+                return samples
+    return None
+
+
+def keyframe_numbers(path):
+    """
+    Ключевые кадры mp4 из таблицы stss, без декодирования видео
+    :return: List[int] - номера кадров с 0, или None, если таблицы нет (тогда ключевой - каждый кадр)
+    """
+    try:
+        with open(path, 'rb') as f:
+            samples = video_sync_samples(f, 0, os.fstat(f.fileno()).st_size)
+    except (OSError, struct.error) as e:
+        print(e)
+        return None
+    return [sample - 1 for sample in samples] if samples is not None else None
+
+
+def sparse_index(frames, fps, interval=INDEX_INTERVAL):
+    """Точки перемотки: ключевые кадры не чаще одного на interval секунд"""
+    index = []
+    for frame in frames:
+        time = frame / fps
+        if not index or time - index[-1]['t'] >= interval:
+            index.append({'t': round(time, 3), 'frame': frame})
+    return index
+
+
+def index_clip(path, thumb_width=THUMB_WIDTH, interval=INDEX_INTERVAL):
+    """
+    Постер (кадр из середины клипа) и разреженный индекс ключевых кадров рядом с клипом:
+    <клип>.thumb.jpg и <клип>.index.json
+    :return: dict - содержимое индекса или None, если клип не читается
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if frame_count <= 0:
+            return None
+
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 2)
+        ok, poster = capture.read()
+        if not ok:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, poster = capture.read()
+        if not ok:
+            return None
+    finally:
+        capture.release()
+
+    if poster.shape[1] > thumb_width:
+        poster = cv2.resize(poster, (thumb_width, poster.shape[0] * thumb_width // poster.shape[1]),
+                            interpolation=cv2.INTER_AREA)
+    cv2.imwrite(thumb_path(path), poster, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+
+    keyframes = keyframe_numbers(path)
+    index = {
+        'duration': round(frame_count / fps, 3),
+        'fps': round(fps, 3),
+        'frame_count': frame_count,
+        'width': width,
+        'height': height,
+        'keyframes': sparse_index(keyframes if keyframes is not None else range(frame_count), fps, interval)
+    }
+    tmp_path = f"{index_path(path)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path(path))
+    return index
+
+
+def load_clip_index(path):
+    """:return: dict индекса клипа или None, если клип ещё не обработан"""
+    try:
+        with open(index_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def process_clip(path):
+    try:
+        return index_clip(path)
+    except Exception as e:
+        print(e)
+
+
+indexer = None
+
+
+def index_clip_async(path):
+    """Обработать закрытый клип в фоне, не задерживая запись следующего сегмента"""
+    global indexer
+    if indexer is None:
+        indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clip-indexer')
+    return indexer.submit(process_clip, path)
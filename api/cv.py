@@ -1,6 +1,9 @@
 import datetime as dt
+import json
+import multiprocessing
 import os
-from threading import Thread
+from queue import Empty, Full
+from threading import Condition, Lock, Thread
 
 import cv2
 import imutils
@@ -8,8 +11,16 @@ import numpy as np
 from imutils.object_detection import non_max_suppression
 from requests import get, post, put, patch, delete, options, head
 
-from api.config import PROJECT_DIR, CAMERA_ID, LOCATION, API_BASE_URL
+from api.config import PROJECT_DIR, API_BASE_URL, DETECTOR_CADENCE, DETECTOR_REFRESH_INTERVAL, MOTION_THRESHOLD, \
+    DETECTOR_WORKERS, DETECTOR_PINNING, FIRE_COARSE_TO_FINE, FIRE_MIN_FLAME_RATIO, STREAM_JPEG_QUALITY, \
+    STREAM_MIN_JPEG_QUALITY, STREAM_MAX_FPS, STREAM_TARGET_KBPS, USE_TURBOJPEG, CLIP_PREROLL_FRAMES, CLIP_QUEUE_SIZE, \
+    CLIP_DROP_POLICY, CLIP_PREROLL_JPEG_QUALITY, CLIP_PREROLL_SECONDS, CLIP_POSTROLL_SECONDS, CLIP_SEGMENT_SECONDS
+from api.detection import DetectionScheduler, DetectorPool, FireDetector, MotionDetector
+from api.encoding import ClientStream, EncodedFrameCache, multipart_frame
+from api.clips import index_clip_async
 from api.keyclipwriter import KeyClipWriter
+from api.recording import EventRecorder
+from api.shared_frames import SharedFrameReader, SharedFrameWriter
 
 # classifiers
 haarcascades_path = cv2.data.haarcascades
@@ -19,19 +30,44 @@ fire_cascade_path = os.path.join(PROJECT_DIR, "fire_detection.xml")
 # images
 error_image_path = os.path.join(PROJECT_DIR, "error.jpg")
 
-# classifiers and HOGDescriptor
-face_cascade = cv2.CascadeClassifier(face_cascade_path)
-fire_cascade = cv2.CascadeClassifier(fire_cascade_path)
+# classifiers, HOGDescriptor, error image and clip writer are created on first use (in the camera process),
+# so importing api.cv doesn't cost every API worker and CLI command the model loading
+classifiers = None
+classifiers_lock = Lock()
+error_frame = None
+kcw = None
+
+
+def get_classifiers():
+    global classifiers
+    with classifiers_lock:
+        if classifiers is None:
+            hog = cv2.HOGDescriptor()
+            hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+            classifiers = {
+                'face': cv2.CascadeClassifier(face_cascade_path),
+                'fire': cv2.CascadeClassifier(fire_cascade_path),
+                'hog': hog
+            }
+    return classifiers
+
+
+def get_error_frame():
+    """Куски multipart кадра с error.jpg, который получает клиент, когда камера недоступна"""
+    global error_frame
+    if error_frame is None:
+        _, buffer = cv2.imencode('.jpg', cv2.imread(error_image_path))
+        error_frame = generate_image(buffer.tobytes())
+    return error_frame
+
+
+def get_clip_writer():
+    global kcw
+    if kcw is None:
+        kcw = KeyClipWriter(bufSize=CLIP_PREROLL_FRAMES, queueSize=CLIP_QUEUE_SIZE, dropPolicy=CLIP_DROP_POLICY,
+                            jpegQuality=CLIP_PREROLL_JPEG_QUALITY, onFinish=index_clip_async)
+    return kcw
 
-hog = cv2.HOGDescriptor()
-hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-
-# camera and error image
-camera = cv2.VideoCapture(0)
-error_image = cv2.imread(error_image_path)
-_, error_image_in_bytes = cv2.imencode('.jpg', error_image)
-
-kcw = KeyClipWriter()
 
 # Colors
 red = (0, 0, 255)
@@ -39,11 +75,6 @@ green = (0, 255, 0)
 blue = (255, 0, 0)
 yellow = (0, 255, 255)
 
-is_first_detection = True
-last_detection_time = None
-fire_exists = False
-five_seconds_passed = False
-
 request_methods = {
     'get': get,
     'post': post,
@@ -71,8 +102,7 @@ def async_request(method, *args, callback=None, timeout=15, **kwargs):
 
 
 def generate_image(buffer):
-    return (b'--frame\r\n'
-            b'Content-Type: image/jpeg\r\n\r\n' + bytearray(buffer) + b'\r\n')
+    return multipart_frame(buffer)
 
 
 def frame_in_rect(objects, frame, title, color):
@@ -84,9 +114,9 @@ def frame_in_rect(objects, frame, title, color):
         cv2.putText(frame, title, (x, y - 2), cv2.FONT_HERSHEY_SIMPLEX, 1, blue, 2)
 
 
-def send_log(recognized_objects, filename):
+def send_log(camera_id, recognized_objects, filename):
     data = {
-        "camera_id": CAMERA_ID,
+        "camera_id": camera_id,
         "recognized_objects": recognized_objects,
         "filename": filename
     }
@@ -98,76 +128,278 @@ def send_log(recognized_objects, filename):
         print(e)
 
 
-def gen_video():
-    while True:
-        _, frame = camera.read()
-        if frame is None:
-            print("No image!")
-            break
+class FrameBroadcaster:
+    """
+    Один поток захвата и детекции на камеру публикует последний готовый кадр,
+    клиенты /camera забирают самый свежий кадр в своём темпе, пропуская те, что не успели отдать
+    """
 
-        frame = imutils.resize(frame, width=min(480, frame.shape[0]))
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def __init__(self, frames):
+        self.frames = frames
+        self.condition = Condition()
+        self.frame = None
+        self.seq = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for frame in self.frames():
+                self.publish(frame)
+        except Exception as e:
+            print(e)
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.condition.notify_all()
+
+    def stream(self, timeout=5.0):
+        seq = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.seq != seq or not self.running, timeout)
+                if self.seq == seq:
+                    if not self.running:
+                        return
+                    continue
+                seq, frame = self.seq, self.frame
+            yield seq, frame
+
+
+def parse_source(source):
+    """Индекс устройства, путь к файлу или URL (RTSP, HTTP) для cv2.VideoCapture"""
+    if source is None:
+        return 0
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+
+def detect_faces(frame, gray):
+    return get_classifiers()['face'].detectMultiScale(gray, 1.1, 3)
+
+
+def detect_fire(frame, gray):
+    return get_classifiers()['fire'].detectMultiScale(gray, 1.05, 3)
+
+
+def detect_persons(frame, gray):
+    (persons, _) = get_classifiers()['hog'].detectMultiScale(frame,
+                                                             winStride=(5, 5),
+                                                             padding=(2, 2),
+                                                             scale=1.3)
+    return persons
+
+
+DETECTORS = {
+    'face': detect_faces,
+    'fire': detect_fire,
+    'person': detect_persons
+}
 
-        faces = face_cascade.detectMultiScale(gray, 1.1, 3)
-        fire = fire_cascade.detectMultiScale(gray, 1.05, 3)
-        (persons, _) = hog.detectMultiScale(frame,
-                                            winStride=(5, 5),
-                                            padding=(2, 2),
-                                            scale=1.3)
 
-        persons_count = len(persons)
-        fire_count = len(fire)
+def parse_detectors(detectors):
+    """Включённые детекторы камеры: строка 'face,fire' из Camera.detectors, None - все"""
+    if not detectors:
+        return list(DETECTORS)
+    return [name.strip() for name in detectors.split(',') if name.strip() in DETECTORS]
 
-        global is_first_detection, last_detection_time, fire_exists, five_seconds_passed
 
-        if fire_count > 0:
-            fire_exists = True
-            filename = None
-            if not kcw.recording:
-                timestamp = dt.datetime.now()
-                filename = f"fire-{timestamp.strftime('%m-%d-%Y %H-%M-%S')}.mp4"
-                kcw.start(filename, cv2.VideoWriter_fourcc(*"H264"), 30)
+def create_fire_detector(rois=None):
+    return FireDetector(get_classifiers()['fire'], rois=rois, coarse_to_fine=FIRE_COARSE_TO_FINE,
+                        min_flame_ratio=FIRE_MIN_FLAME_RATIO)
 
-            current_detection_time = dt.datetime.now()
 
-            if is_first_detection:
-                send_log(recognized_objects="Warning! Fire detected", filename=filename)
-                last_detection_time = current_detection_time
-                is_first_detection = False
+def create_scheduler(enabled=None, fire_roi=None):
+    detectors = {name: DETECTORS[name] for name in (enabled or DETECTORS)}
+    if 'fire' in detectors:
+        detectors['fire'] = create_fire_detector(json.loads(fire_roi) if fire_roi else None)
+    pool = DetectorPool(min(DETECTOR_WORKERS, len(detectors)), DETECTOR_PINNING) if DETECTOR_WORKERS > 1 else None
+    return DetectionScheduler(detectors, cadence=DETECTOR_CADENCE,
+                              motion_detector=MotionDetector(threshold=MOTION_THRESHOLD),
+                              refresh_interval=DETECTOR_REFRESH_INTERVAL, pool=pool)
 
-            time_diff = current_detection_time - last_detection_time
-            last_detection_time = current_detection_time
 
-            if time_diff.seconds > 10:
-                send_log(recognized_objects="Warning! Fire detected", filename=filename)
+def create_recorder(camera_id):
+    def on_segment(filename, segment_index):
+        if segment_index == 0:
+            send_log(camera_id, recognized_objects="Warning! Fire detected", filename=filename)
+        else:
+            send_log(camera_id, recognized_objects=f"Fire still detected (part {segment_index + 1})",
+                     filename=filename)
+
+    # камеры пишут в один каталог каждая в своём процессе: id камеры в имени, чтобы события,
+    # начавшиеся в одну секунду, не писали в один файл
+    return EventRecorder(get_clip_writer(), PROJECT_DIR, prefix=f'fire-{camera_id}', preroll=CLIP_PREROLL_SECONDS,
+                         postroll=CLIP_POSTROLL_SECONDS, segment_seconds=CLIP_SEGMENT_SECONDS, on_segment=on_segment)
+
+
+def detect_frames(camera, camera_id, location, detectors=None, fire_roi=None):
+    """Кадры с разметкой (BGR, ещё не закодированные) вместе со статистикой планировщика детекторов: Tuple(кадр, dict)"""
+    scheduler = create_scheduler(parse_detectors(detectors), fire_roi)
+    recorder = create_recorder(camera_id)
+    gray = None
+    while True:
+        _, frame = camera.read()
+        if frame is None:
+            print("No image!")
+            break
 
-        if fire_count == 0:
-            fire_exists = False
+        frame = imutils.resize(frame, width=min(480, frame.shape[0]))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, gray)
 
-            if not is_first_detection:
-                last_fire_extinction_time = dt.datetime.now()
-                time_diff = last_fire_extinction_time - last_detection_time
+        boxes = scheduler.run(frame, gray)
+        faces = boxes.get('face', ())
+        fire = boxes.get('fire', ())
+        persons = boxes.get('person', ())
 
-                if time_diff.seconds > 5:
-                    five_seconds_passed = True
+        persons_count = len(persons)
+        fire_count = len(fire)
 
         frame_in_rect(faces, frame, "face", green)
         frame_in_rect(fire, frame, "fire", red)
         frame_in_rect(persons, frame, "person", yellow)
 
-        cv2.putText(frame, f"CAMERA {CAMERA_ID} - Location: {LOCATION}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, red,
+        cv2.putText(frame, f"CAMERA {camera_id} - Location: {location}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, red,
                     2)
         cv2.putText(frame, f"Faces: {len(faces)} - Persons: {persons_count} - Fire in the frame: {len(fire) > 0}",
                     (10, frame.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, green, 2)
 
-        kcw.update(frame)
+        recorder.update(frame, fire_count > 0)
+
+        yield frame, dict(scheduler.stats(), recorder=recorder.stats())
+
 
-        if kcw.recording and not fire_exists and five_seconds_passed:
+def camera_process(camera_id, source, location, detectors, fire_roi, frames):
+    """
+    Точка входа процесса камеры: захват и детекция. Готовые кадры (незакодированные - JPEG кодируется
+    под каждого клиента в ClientStream) пишутся в общую память, в очередь frames кладётся только их описание
+    """
+    camera = cv2.VideoCapture(parse_source(source))
+    # слотов больше, чем кадров в очереди и у читателя, чтобы читаемый кадр не перезаписывался
+    shared = SharedFrameWriter(slots=FRAME_QUEUE_SIZE + 2)
+    try:
+        for frame, stats in detect_frames(camera, camera_id, location, detectors, fire_roi):
+            message = (shared.write(frame), stats)
+            try:
+                frames.put_nowait(message)
+            except Full:
+                # родитель не успевает забирать кадры - выбрасываем самый старый
+                try:
+                    frames.get_nowait()
+                except Empty:
+                    pass
+                try:
+                    frames.put_nowait(message)
+                except Full:
+                    pass
+    finally:
+        camera.release()
+        if kcw is not None and kcw.recording:
             kcw.finish()
-            five_seconds_passed = False
+        shared.close()
+
+
+class CameraWorker:
+    """Процесс детекции одной камеры и раздача его кадров клиентам через FrameBroadcaster"""
+
+    def __init__(self, camera_id, source, location, detectors=None, fire_roi=None):
+        self.camera_id = camera_id
+        self.source = source
+        self.location = location
+        self.detectors = detectors
+        self.fire_roi = fire_roi
+        self.process = None
+        self.queue = None
+        self.stats = None
+        self.broadcaster = FrameBroadcaster(self.frames)
+        self.encoded = EncodedFrameCache()
+
+    def frames(self):
+        self.queue = process_context.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self.process = process_context.Process(target=camera_process,
+                                               args=(self.camera_id, self.source, self.location, self.detectors,
+                                                     self.fire_roi, self.queue),
+                                               name=f'camera-{self.camera_id}', daemon=True)
+        self.process.start()
+        reader = SharedFrameReader()
+        try:
+            while True:
+                try:
+                    descriptor, self.stats = self.queue.get(timeout=1)
+                except Empty:
+                    if not self.process.is_alive():
+                        return
+                    continue
+                # None - процесс камеры уже перезаписал слот, следующий кадр свежее
+                frame = reader.read(descriptor)
+                if frame is not None:
+                    yield frame
+        finally:
+            reader.close()
+
+    def start(self):
+        self.broadcaster.start()
+
+    def stream(self, quality=None, fps=None, kbps=None):
+        """
+        multipart поток для одного клиента
+        :param quality: качество JPEG, по умолчанию STREAM_JPEG_QUALITY
+        :param fps: не больше fps кадров в секунду, по умолчанию STREAM_MAX_FPS
+        :param kbps: целевой битрейт, качество подстраивается под него; по умолчанию STREAM_TARGET_KBPS
+        """
+        self.start()
+        client = ClientStream(self.encoded, quality=quality or STREAM_JPEG_QUALITY, fps=fps or STREAM_MAX_FPS,
+                              target_kbps=kbps or STREAM_TARGET_KBPS, min_quality=STREAM_MIN_JPEG_QUALITY,
+                              use_turbo=USE_TURBOJPEG)
+        yield from client.stream(self.broadcaster.stream())
+        yield from get_error_frame()
+
+
+class CameraManager:
+    """
+    Процессы камер по id. Каждая камера (строка Camera) детектирует в своём процессе, чтобы обойти GIL
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.workers = {}
+
+    def worker(self, camera_id, source=None, location=None, detectors=None, fire_roi=None):
+        with self.lock:
+            worker = self.workers.get(camera_id)
+            settings = (source, location, detectors, fire_roi)
+            if worker is None or (worker.source, worker.location, worker.detectors, worker.fire_roi) != settings \
+                    and not worker.broadcaster.running:
+                worker = CameraWorker(camera_id, *settings)
+                self.workers[camera_id] = worker
+            return worker
+
+    def start_all(self, cameras):
+        """:param cameras: Iterable[Tuple(camera_id, source, location, detectors, fire_roi)]"""
+        for camera_id, *settings in cameras:
+            self.worker(camera_id, *settings).start()
+
 
-        _, buffer = cv2.imencode('.jpg', frame)
+process_context = multiprocessing.get_context('spawn')
+# описаний кадров в очереди от процесса камеры
+FRAME_QUEUE_SIZE = 2
+camera_manager = CameraManager()
 
-        yield generate_image(buffer)
 
-    yield generate_image(error_image_in_bytes)
+def gen_video(camera_id, source=None, location=None, detectors=None, fire_roi=None, quality=None, fps=None,
+              kbps=None):
+    yield from camera_manager.worker(camera_id, source, location, detectors, fire_roi).stream(quality, fps, kbps)
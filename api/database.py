@@ -0,0 +1,45 @@
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def is_sqlite(uri):
+    return make_url(uri).drivername.startswith('sqlite')
+
+
+def engine_options(uri, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, pool_pre_ping=False):
+    """
+    Параметры create_engine для SQLALCHEMY_ENGINE_OPTIONS.
+    SQLite-файл по умолчанию открывается заново на каждую сессию (NullPool), и его кэш страниц и mmap
+    пропадают вместе с соединением, поэтому для него тоже включается пул
+    """
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pool_pre_ping
+    }
+    if is_sqlite(uri):
+        database = make_url(uri).database
+        if not database or database == ':memory:':
+            # база в памяти живёт в одном соединении, его настраивает Flask-SQLAlchemy
+            return {}
+        options['poolclass'] = QueuePool
+        # соединение из пула может достаться другому потоку, сессии при этом не разделяются
+        options['connect_args'] = {'check_same_thread': False}
+    return options
+
+
+def init_sqlite(engine, pragmas):
+    """PRAGMA для каждого нового соединения SQLite: WAL, synchronous, mmap_size, cache_size, busy_timeout"""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+                cursor.fetchall()
+        finally:
+            cursor.close()
@@ -0,0 +1,258 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+    """
+    Дешёвая проверка движения: разница двух соседних кадров в уменьшенном и размытом виде
+    """
+
+    def __init__(self, threshold=0.002, scale=0.25, pixel_threshold=25):
+        # доля изменившихся пикселей, начиная с которой считаем, что в кадре есть движение
+        self.threshold = threshold
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.previous = None
+
+    def __call__(self, gray):
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        previous, self.previous = self.previous, small
+        if previous is None or previous.shape != small.shape:
+            return True
+        diff = cv2.absdiff(previous, small)
+        changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+        return changed > self.threshold * small.size
+
+
+class DetectorPool:
+    """
+    Пул потоков для детекторов одного кадра. OpenCV отпускает GIL в detectMultiScale, поэтому детекторы
+    на разных потоках идут параллельно. Каждый поток - отдельный однопоточный executor, так что детектор
+    можно закрепить за потоком (pinning: Dict[имя, номер потока]), остальные раздаются по кругу
+    """
+
+    def __init__(self, workers=3, pinning=None):
+        self.executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'detector-{i}')
+                          for i in range(max(1, workers))]
+        self.pinning = pinning or {}
+        self.next_executor = cycle(self.executors)
+
+    def executor(self, name):
+        if name in self.pinning:
+            return self.executors[self.pinning[name] % len(self.executors)]
+        return next(self.next_executor)
+
+    def map(self, calls):
+        """
+        Запустить детекторы параллельно и дождаться всех
+        :param calls: Dict[имя, Tuple(callable, args)]
+        :return: Dict[имя, результат]
+        """
+        if len(calls) == 1 or len(self.executors) == 1:
+            return {name: detector(*args) for name, (detector, args) in calls.items()}
+        futures = {name: self.executor(name).submit(detector, *args) for name, (detector, args) in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def shutdown(self, wait=True):
+        for executor in self.executors:
+            executor.shutdown(wait=wait)
+
+
+class DetectionScheduler:
+    """
+    Решает, на каких кадрах запускать дорогие детекторы. Детекторы работают только на кадрах с движением,
+    каждый со своим шагом (cadence - раз в сколько кадров), в остальных кадрах переиспользуются последние рамки.
+    Раз в refresh_interval кадров детекторы запускаются и без движения, чтобы не держать устаревшие рамки
+    """
+
+    def __init__(self, detectors, cadence=None, motion_detector=None, refresh_interval=100, pool=None):
+        # detectors: Dict[имя, callable(frame, gray) -> рамки]
+        self.detectors = detectors
+        # DetectorPool для параллельного запуска, без него детекторы идут по очереди
+        self.pool = pool
+        self.cadence = {name: 1 for name in detectors}
+        self.cadence.update(cadence or {})
+        self.motion_detector = motion_detector
+        self.refresh_interval = refresh_interval
+        self.frame_index = 0
+        self.last_run = {name: None for name in detectors}
+        self.boxes = {name: np.empty((0, 4), dtype=int) for name in detectors}
+        self.processed = {name: 0 for name in detectors}
+        self.skipped = {name: 0 for name in detectors}
+        self.motion_frames = 0
+
+    def due(self, name, motion):
+        last_run = self.last_run[name]
+        if last_run is None or self.frame_index - last_run >= self.refresh_interval:
+            return True
+        return motion and self.frame_index - last_run >= self.cadence[name]
+
+    def run(self, frame, gray):
+        """:return: Dict[имя детектора, рамки] - свежие или с последнего запуска"""
+        self.frame_index += 1
+        motion = self.motion_detector(gray) if self.motion_detector is not None else True
+        if motion:
+            self.motion_frames += 1
+
+        calls = {}
+        for name, detector in self.detectors.items():
+            if self.due(name, motion):
+                calls[name] = (detector, (frame, gray))
+                self.last_run[name] = self.frame_index
+                self.processed[name] += 1
+            else:
+                self.skipped[name] += 1
+
+        if self.pool is not None:
+            self.boxes.update(self.pool.map(calls))
+        else:
+            self.boxes.update({name: detector(*args) for name, (detector, args) in calls.items()})
+        return dict(self.boxes)
+
+    def stats(self):
+        return {
+            'frames': self.frame_index,
+            'motion_frames': self.motion_frames,
+            'processed': dict(self.processed),
+            'skipped': dict(self.skipped),
+            'detectors': {name: detector.stats() for name, detector in self.detectors.items()
+                          if hasattr(detector, 'stats')}
+        }
+
+
+def parse_rois(rois, shape):
+    """
+    Области интереса в пикселях кадра
+    :param rois: List[[x, y, w, h]] в долях кадра (0..1), None - весь кадр
+    :param shape: размер кадра (высота, ширина, ...)
+    :return: List[Tuple(x, y, w, h)]
+    """
+    height, width = shape[:2]
+    if not rois:
+        return [(0, 0, width, height)]
+    result = []
+    for x, y, w, h in rois:
+        x1, y1 = max(0, int(x * width)), max(0, int(y * height))
+        x2, y2 = min(width, int((x + w) * width)), min(height, int((y + h) * height))
+        if x2 > x1 and y2 > y1:
+            result.append((x1, y1, x2 - x1, y2 - y1))
+    return result
+
+
+def merge_windows(windows):
+    """Слить пересекающиеся окна (x1, y1, x2, y2) в общие прямоугольники, чтобы участок не сканировался дважды"""
+    windows = [list(window) for window in windows]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for window in windows:
+            for other in result:
+                if window[0] < other[2] and other[0] < window[2] and window[1] < other[3] and other[1] < window[3]:
+                    other[:] = [min(window[0], other[0]), min(window[1], other[1]),
+                                max(window[2], other[2]), max(window[3], other[3])]
+                    merged = True
+                    break
+            else:
+                result.append(window)
+        windows = result
+    return windows
+
+
+def group_boxes(boxes, eps=0.2):
+    """Одна рамка на объект: близкие рамки (x, y, w, h) объединяются cv2.groupRectangles"""
+    boxes = [[int(value) for value in box] for box in boxes]
+    if len(boxes) < 2:
+        return np.array(boxes, dtype=int).reshape(-1, 4)
+    # каждая рамка дважды, чтобы groupThreshold=1 не отбрасывал одиночные
+    grouped, _ = cv2.groupRectangles(boxes * 2, 1, eps)
+    return np.array(grouped, dtype=int).reshape(-1, 4)
+
+
+class FireDetector:
+    """
+    Каскад огня с ограничениями, чтобы не сканировать весь кадр с шагом 1.05:
+    - только области интереса камеры (Camera.fire_roi);
+    - предварительный фильтр по цвету пламени в HSV (включается min_flame_ratio): нет пикселей нужных
+      оттенков - каскад не запускается;
+    - coarse-to-fine: грубый проход по кадру, уменьшенному вдвое, с крупным шагом масштаба, затем точный проход
+      в полном разрешении только вокруг найденных кандидатов; пересекающиеся окна кандидатов сливаются
+      и сканируются один раз.
+    Близкие рамки одного объекта объединяются (cv2.groupRectangles)
+    """
+
+    # оттенки пламени: красный - оранжевый - жёлтый, насыщенные и яркие
+    FLAME_LOWER = np.array([0, 80, 160], dtype=np.uint8)
+    FLAME_UPPER = np.array([35, 255, 255], dtype=np.uint8)
+
+    def __init__(self, cascade, rois=None, scale_factor=1.05, min_neighbors=3, coarse_to_fine=True,
+                 coarse_scale=0.5, coarse_scale_factor=1.1, coarse_min_neighbors=2, margin=0.25,
+                 min_flame_ratio=None):
+        self.cascade = cascade
+        self.rois = rois
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.coarse_to_fine = coarse_to_fine
+        self.coarse_scale = coarse_scale
+        self.coarse_scale_factor = coarse_scale_factor
+        # грубый проход почти ничего не пропускает, подтверждает точный проход с min_neighbors
+        self.coarse_min_neighbors = coarse_min_neighbors
+        # насколько расширять кандидата грубого прохода перед точным, в долях его размера
+        self.margin = margin
+        # минимальная доля пикселей цвета пламени в области, None - без фильтра
+        self.min_flame_ratio = min_flame_ratio
+        self.checked = 0
+        self.rejected = 0
+
+    def has_flame_colors(self, frame):
+        if self.min_flame_ratio is None:
+            return True
+        small = cv2.resize(frame, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA) \
+            if min(frame.shape[:2]) >= 32 else frame
+        mask = cv2.inRange(cv2.cvtColor(small, cv2.COLOR_BGR2HSV), self.FLAME_LOWER, self.FLAME_UPPER)
+        return cv2.countNonZero(mask) >= self.min_flame_ratio * mask.size
+
+    def detect(self, gray, scale_factor, min_neighbors):
+        found = self.cascade.detectMultiScale(gray, scale_factor, min_neighbors)
+        return np.array(found, dtype=int).reshape(-1, 4)
+
+    def refine(self, gray, candidates):
+        """Точный проход в полном разрешении вокруг кандидатов грубого прохода"""
+        height, width = gray.shape[:2]
+        windows = []
+        for x, y, w, h in candidates:
+            dx, dy = int(w * self.margin), int(h * self.margin)
+            windows.append((max(0, x - dx), max(0, y - dy), min(width, x + w + dx), min(height, y + h + dy)))
+        boxes = []
+        for x1, y1, x2, y2 in merge_windows(windows):
+            found = self.detect(gray[y1:y2, x1:x2], self.scale_factor, self.min_neighbors)
+            boxes.extend((fx + x1, fy + y1, fw, fh) for fx, fy, fw, fh in found)
+        return boxes
+
+    def detect_region(self, gray):
+        if not self.coarse_to_fine:
+            return self.detect(gray, self.scale_factor, self.min_neighbors)
+        small = cv2.resize(gray, None, fx=self.coarse_scale, fy=self.coarse_scale, interpolation=cv2.INTER_AREA)
+        candidates = self.detect(small, self.coarse_scale_factor, self.coarse_min_neighbors)
+        candidates = (candidates / self.coarse_scale).astype(int)
+        if not len(candidates):
+            return candidates
+        return np.array(self.refine(gray, candidates), dtype=int).reshape(-1, 4)
+
+    def __call__(self, frame, gray):
+        boxes = []
+        for x, y, w, h in parse_rois(self.rois, frame.shape):
+            self.checked += 1
+            if not self.has_flame_colors(frame[y:y + h, x:x + w]):
+                self.rejected += 1
+                continue
+            found = self.detect_region(gray[y:y + h, x:x + w])
+            boxes.extend((fx + x, fy + y, fw, fh) for fx, fy, fw, fh in found)
+        return group_boxes(boxes)
+
+    def stats(self):
+        return {'regions_checked': self.checked, 'regions_rejected_by_color': self.rejected}
@@ -0,0 +1,201 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from sqlalchemy import BigInteger, cast, func, or_, and_, not_
+
+from api.models import db
+
+# ширина интервала агрегации в секундах
+BUCKETS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '6h': 21600,
+    '1d': 86400
+}
+
+SENSOR_FIELDS = {
+    'MQ2Data': ('lpg', 'co', 'smoke'),
+    'DHTData': ('temp', 'hudimity')
+}
+
+
+# типы колонок показаний в массивах и архиве: ppm газов не помещаются в int16
+COLUMN_DTYPES = {
+    'MQ2Data': {'lpg': np.int32, 'co': np.int32, 'smoke': np.int32},
+    'DHTData': {'temp': np.int16, 'hudimity': np.int16}
+}
+
+FETCH_BATCH_SIZE = 10000
+
+
+def to_epoch(date_times):
+    return np.array(date_times, dtype='datetime64[s]').astype(np.int64)
+
+
+def from_epoch(timestamps):
+    return timestamps.astype('datetime64[s]').tolist()
+
+
+def epoch_seconds(column):
+    """
+    Время в epoch-секундах на стороне базы, чтобы не создавать datetime на каждую строку.
+    Дробные секунды отбрасываются: strftime('%s') в SQLite усекает, а extract(epoch) возвращает дробное
+    число, которое cast в bigint округлил бы, поэтому для других баз сначала floor
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.strftime('%s', column), BigInteger)
+    return cast(func.floor(func.extract('epoch', column)), BigInteger)
+
+
+def fetch_columns(query, dtypes):
+    """
+    Выполнить запрос и сложить строки DB-API курсора сразу в массивы NumPy, без ORM объектов и RowProxy
+    :param query: Query, колонки которого идут в порядке dtypes и возвращают числа
+    :param dtypes: List[Tuple(имя, dtype)]
+    :return: Dict[имя, np.ndarray]
+    """
+    dtype = np.dtype(dtypes)
+    result = db.session.execute(query.statement)
+    chunks = []
+    try:
+        while True:
+            rows = result.cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=dtype))
+    finally:
+        result.close()
+    table = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    return {name: np.ascontiguousarray(table[name]) for name in dtype.names}
+
+
+def filter_series(query, model, date_from=None, date_to=None, device_id=None, case_id=None):
+    query = query.filter(model.date_time.isnot(None))
+    if device_id is not None:
+        query = query.filter(model.device_id == device_id)
+    if case_id is not None:
+        query = query.filter(model.case_id == case_id)
+    if date_from is not None:
+        query = query.filter(model.date_time >= date_from)
+    if date_to is not None:
+        query = query.filter(model.date_time < date_to)
+    return query
+
+
+def exclude_days(query, model, days, max_id):
+    """
+    Не читать из базы строки суток, которые уже лежат в архиве: с id не больше max_id архива.
+    Строки, дописанные в эти сутки после архивации, по-прежнему читаются из базы
+    """
+    ranges = []
+    for day in days:
+        start = datetime.combine(day, time())
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], start + timedelta(days=1))
+        else:
+            ranges.append((start, start + timedelta(days=1)))
+    if not ranges:
+        return query
+    archived = or_(*[and_(model.date_time >= start, model.date_time < end) for start, end in ranges])
+    return query.filter(not_(and_(archived, model.id <= max_id)))
+
+
+def load_series(model, date_from=None, date_to=None, device_id=None, case_id=None):
+    """
+    Загрузить показания в массивы: epoch-секунды int64 и колонки int32/int16 из COLUMN_DTYPES.
+    За период без case_id сутки из архива показаний (SENSOR_ARCHIVE_DIR) читаются из .npy, остальное
+    и строки, дописанные в заархивированные сутки после архивации, - из базы.
+    Показания случаев не удаляются политикой хранения, поэтому с case_id читается только база
+    :return: Tuple(np.ndarray с epoch-секундами, Dict[поле, np.ndarray])
+    """
+    from api.archive import get_archive
+
+    fields = SENSOR_FIELDS[model.__name__]
+    dtypes = [('date_time', np.int64)] + [(field, COLUMN_DTYPES[model.__name__][field]) for field in fields]
+    query = db.session.query(epoch_seconds(model.date_time), *[getattr(model, field) for field in fields])
+    query = filter_series(query, model, date_from, date_to, device_id, case_id)
+
+    archive = get_archive() if case_id is None else None
+    days = archive.days(model, date_from, date_to) if archive is not None else []
+    if days:
+        query = exclude_days(query, model, days, archive.max_id(model))
+    columns = fetch_columns(query.order_by(model.date_time, model.id), dtypes)
+
+    if days:
+        parts = [archive.load(model, day, date_from, date_to, device_id) for day in days] + [columns]
+        columns = {name: np.concatenate([part[name] for part in parts]) for name, _ in dtypes}
+        order = np.argsort(columns['date_time'], kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+    return columns['date_time'], {field: columns[field] for field in fields}
+
+
+def pick_bucket(span, max_points):
+    """Наименьшая ширина интервала, при которой на span секунд будет не больше max_points точек"""
+    for width in sorted(BUCKETS.values()):
+        if span / width <= max_points:
+            return width
+    day = BUCKETS['1d']
+    return -(-span // (max_points * day)) * day
+
+
+def group_starts(buckets):
+    return np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+
+
+def downsample(timestamps, values, width):
+    """
+    min/max/sum/avg по интервалам ширины width секунд; timestamps отсортированы по возрастанию
+    :return: Tuple(начала интервалов, количество точек, Dict[поле, Dict['min'|'max'|'sum'|'avg', np.ndarray]])
+    """
+    if len(timestamps) == 0:
+        return timestamps, np.empty(0, dtype=np.int64), {field: {'min': column, 'max': column, 'sum': column,
+                                                                 'avg': column} for field, column in values.items()}
+
+    buckets = timestamps // width
+    starts = group_starts(buckets)
+    counts = np.diff(np.append(starts, len(timestamps)))
+
+    aggregates = {}
+    for field, column in values.items():
+        total = np.add.reduceat(column.astype(np.int64), starts)
+        aggregates[field] = {
+            'min': np.minimum.reduceat(column, starts),
+            'max': np.maximum.reduceat(column, starts),
+            'sum': total,
+            'avg': total / counts
+        }
+    return buckets[starts] * width, counts, aggregates
+
+
+def rebucket(bucket_starts, counts, aggregates, width):
+    """Объединить уже агрегированные интервалы (например, из rollup таблиц) в интервалы ширины width"""
+    if len(bucket_starts) == 0:
+        return downsample(bucket_starts, {field: aggregate['sum'] for field, aggregate in aggregates.items()}, width)
+
+    buckets = bucket_starts // width
+    starts = group_starts(buckets)
+    merged_counts = np.add.reduceat(counts, starts)
+
+    merged = {}
+    for field, aggregate in aggregates.items():
+        total = np.add.reduceat(aggregate['sum'], starts)
+        merged[field] = {
+            'min': np.minimum.reduceat(aggregate['min'], starts),
+            'max': np.maximum.reduceat(aggregate['max'], starts),
+            'sum': total,
+            'avg': total / merged_counts
+        }
+    return buckets[starts] * width, merged_counts, merged
+
+
+def to_records(bucket_starts, counts, aggregates):
+    """Результат downsample/rebucket в виде списка словарей для JSON ответа"""
+    records = []
+    for i, date_time in enumerate(from_epoch(bucket_starts)):
+        record = {'date_time': date_time, 'count': int(counts[i])}
+        for field, aggregate in aggregates.items():
+            record[field] = {name: aggregate[name][i].item() for name in ('min', 'max', 'avg')}
+        records.append(record)
+    return records
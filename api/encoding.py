@@ -0,0 +1,126 @@
+import time
+from threading import Lock
+
+import cv2
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+MULTIPART_TRAILER = b'\r\n'
+
+
+def multipart_frame(jpeg):
+    """
+    Часть multipart/x-mixed-replace ответа отдельными кусками: заголовок, JPEG и CRLF.
+    JPEG не копируется в общий буфер с заголовком, WSGI сервер пишет куски в сокет по очереди
+    """
+    return MULTIPART_HEADER % len(jpeg), jpeg, MULTIPART_TRAILER
+
+
+class JpegEncoder:
+    """
+    JPEG кодировщик кадров: TurboJPEG, если установлен (pip install PyTurboJPEG и libturbojpeg), иначе cv2.imencode.
+    Экземпляр TurboJPEG не потокобезопасен - один кодировщик на поток.
+    Возвращает bytes: WSGI серверы принимают куски ответа только в bytes
+    """
+
+    def __init__(self, use_turbo=True):
+        self.turbo = None
+        if use_turbo and TurboJPEG is not None:
+            try:
+                self.turbo = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(e)
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), 80]
+
+    def encode(self, frame, quality):
+        if self.turbo is not None:
+            return self.turbo.encode(frame, quality=quality)
+        self.params[1] = quality
+        _, buffer = cv2.imencode('.jpg', frame, self.params)
+        return buffer.tobytes()
+
+
+class QualityController:
+    """
+    Качество JPEG под целевой битрейт клиента: если кадры выходят больше бюджета kbps / fps - качество снижается,
+    если заметно меньше - повышается. Без target_kbps качество постоянное
+    """
+
+    def __init__(self, quality=80, target_kbps=None, min_quality=30, max_quality=95, step=5):
+        self.quality = quality
+        self.target_kbps = target_kbps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.step = step
+
+    def update(self, size, fps):
+        if not self.target_kbps or not fps:
+            return self.quality
+        budget = self.target_kbps * 125 / fps
+        if size > budget * 1.1:
+            self.quality = max(self.min_quality, self.quality - self.step)
+        elif size < budget * 0.8:
+            self.quality = min(self.max_quality, self.quality + self.step)
+        return self.quality
+
+
+class EncodedFrameCache:
+    """Закодированные части multipart последнего кадра по качеству, чтобы клиенты с одним качеством кодировали кадр один раз"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.seq = None
+        self.parts = {}
+
+    def get(self, seq, quality, build):
+        with self.lock:
+            if self.seq == seq and quality in self.parts:
+                return self.parts[quality]
+        part = build()
+        with self.lock:
+            if self.seq != seq:
+                self.seq, self.parts = seq, {}
+            self.parts[quality] = part
+        return part
+
+
+class ClientStream:
+    """
+    Кадры для одного клиента /camera: ограничение fps, качество (постоянное или под целевой битрейт)
+    и кодирование в JPEG с общим на камеру кэшем
+    """
+
+    def __init__(self, cache, quality=80, fps=None, target_kbps=None, min_quality=30, use_turbo=True):
+        self.cache = cache
+        self.encoder = JpegEncoder(use_turbo)
+        self.controller = QualityController(quality, target_kbps, min_quality=min_quality)
+        self.interval = 1 / fps if fps else 0
+        self.measured_fps = None
+
+    def encode(self, frame):
+        return multipart_frame(self.encoder.encode(frame, self.controller.quality))
+
+    def stream(self, frames):
+        """
+        :param frames: Iterable[Tuple(seq, кадр)] - самые свежие кадры камеры
+        :return: Generator кусков multipart ответа
+        """
+        last_sent = None
+        for seq, frame in frames:
+            quality = self.controller.quality
+            part = self.cache.get(seq, quality, lambda: self.encode(frame))
+            yield from part
+
+            now = time.monotonic()
+            if last_sent is not None and now > last_sent:
+                fps = 1 / (now - last_sent)
+                self.measured_fps = fps if self.measured_fps is None else 0.8 * self.measured_fps + 0.2 * fps
+            last_sent = now
+            self.controller.update(len(part[1]), 1 / self.interval if self.interval else self.measured_fps)
+
+            if self.interval:
+                time.sleep(max(0.0, last_sent + self.interval - time.monotonic()))
@@ -7,7 +7,9 @@ from flask_migrate import Migrate
 from flask_mail import Mail
 from flask_compress import Compress
 
-from .config import cfg
+from .config import cfg, SLOW_QUERY_MS, REQUEST_LOG, SQLITE_PRAGMAS
+from .database import init_sqlite
+from .metrics import init_metrics
 
 app = Flask(__name__, template_folder='../templates', static_folder="../static")
 app.config.from_mapping(cfg)
@@ -17,14 +19,16 @@ migrate = Migrate(app, db)  # Flask-Migrate
 
 with app.app_context():
     if db.engine.url.drivername == 'sqlite':
+        init_sqlite(db.engine, SQLITE_PRAGMAS)  # WAL и другие PRAGMA
         migrate.init_app(app, db, render_as_batch=True)
     else:
         migrate.init_app(app, db)
+    init_metrics(app, db.engine, SLOW_QUERY_MS, REQUEST_LOG)  # метрики запросов и SQL
 
 
 api = Api(app)  # Flask-RESTful
 admin = Admin(app, template_mode='bootstrap3')  # Flask-Admin
-CORS(app)  # Flask-CORS
+CORS(app, expose_headers=['X-Next-Cursor'])  # Flask-CORS
 mail = Mail(app)  # Flask-Mail
 Compress(app)  # Flask-Compress
 
@@ -35,7 +39,8 @@ import api.admin
 
 @app.after_request
 def after_request(response):
-    response.headers.add('Accept-Ranges', 'bytes')
+    # ответы клипов выставляют Accept-Ranges сами
+    response.headers.setdefault('Accept-Ranges', 'bytes')
     return response
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import json
+from datetime import datetime
+
+from api.cache import mq2_cache, dht_cache
+from api.config import CLIENT_APP_BASE_URL
+from api.models import db, Device, MQ2Data, DHTData, Case, Notification
+from api.rollups import update_rollups
+from api.utils import check_gas_levels, LevelType, notify_about_warning
+
+# если между двумя тревожными показаниями прошло больше, чем CASE_GAP секунд - заводим новый случай.
+# Показания пачки сравниваются по порядку времени, первое - с последним записанным показанием
+# в обе стороны, чтобы пачка старых показаний с буфера шлюза не попала в последний случай
+CASE_GAP = 30
+
+
+def parse_date_time(value, default):
+    if value is None:
+        return default
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def insert_rows(model, rows):
+    """
+    Вставить строки одним bulk insert. Последняя по времени строка каждого устройства
+    вставляется через ORM, чтобы узнать её id для кэша последних показаний
+    :param rows: List[dict], отсортированный по date_time
+    :return: List[dict] - последние записанные строки по устройствам
+    """
+    latest = {}
+    for row in rows:
+        latest[row['device_id']] = row
+    latest_rows = {id(row) for row in latest.values()}
+
+    db.session.bulk_insert_mappings(model, [row for row in rows if id(row) not in latest_rows])
+    objs = [model(**row) for row in latest.values()]
+    db.session.add_all(objs)
+    db.session.flush()
+    return [obj.as_dict() for obj in objs]
+
+
+def ingest_mq2_readings(readings):
+    """
+    Записать пачку показаний MQ2 одной транзакцией.
+    Показания без превышения порогов отбрасываются, остальные группируются в случаи
+    :param readings: List[dict] - {'LPG', 'CO', 'Smoke', 'device_id', 'date_time' (необязательно)}
+    :return: Tuple(количество записанных показаний, список id новых случаев)
+    """
+    now = datetime.now()
+    levels = check_gas_levels([reading.get('LPG') for reading in readings],
+                              [reading.get('CO') for reading in readings],
+                              [reading.get('Smoke') for reading in readings],
+                              [reading.get('device_id') for reading in readings])
+    rows = []
+    for reading, level in zip(readings, levels):
+        if level != 0:
+            rows.append({
+                'lpg': reading.get('LPG'),
+                'co': reading.get('CO'),
+                'smoke': reading.get('Smoke'),
+                'device_id': reading.get('device_id'),
+                'date_time': parse_date_time(reading.get('date_time'), now),
+                'level': int(level)
+            })
+
+    if not rows:
+        return 0, []
+
+    rows.sort(key=lambda row: row['date_time'])
+
+    # последние данные с датчиков и последний случай
+    last_mq2data = mq2_cache.get()
+    last_dhtdata = dht_cache.get()
+    case = Case.query.order_by(Case.date_time.desc()).first()
+
+    device_ids = {row['device_id'] for row in rows}
+    devices = {device.id: device for device in Device.query.filter(Device.id.in_(device_ids))}
+
+    last_date_time = last_mq2data['date_time'] if last_mq2data is not None else None
+    new_cases = []
+    row_cases = []
+    for row in rows:
+        if case is None or last_date_time is None or \
+                abs((row['date_time'] - last_date_time).total_seconds()) > CASE_GAP:
+            device = devices.get(row['device_id'])
+            location = device.location if device is not None else None
+            note = f"Warning! Gas detected! " \
+                   f"Location: {location}. " \
+                   f"Gas concentration - LPG: {row['lpg']} ppm - CO: {row['co']} ppm - Smoke: {row['smoke']} ppm."
+            case = Case(note=note, level=LevelType(row['level']), date_time=row['date_time'])
+            db.session.add(case)
+            new_cases.append(case)
+        row_cases.append(case)
+        last_date_time = row['date_time']
+
+    db.session.flush()
+
+    # связываем последние данные DHT с последним случаем
+    if last_dhtdata is not None:
+        DHTData.query.filter_by(id=last_dhtdata['id']).update({'case_id': case.id})
+        last_dhtdata = dict(last_dhtdata, case_id=case.id)
+
+    for row, row_case in zip(rows, row_cases):
+        del row['level']
+        row['case_id'] = row_case.id
+    latest_rows = insert_rows(MQ2Data, rows)
+    update_rollups(MQ2Data, rows)
+
+    messages = []
+    for new_case in new_cases:
+        db.session.add(Notification(content=new_case.note, case_id=new_case.id))
+        messages.append(json.dumps({
+            "type": "case",
+            "link": f"{CLIENT_APP_BASE_URL}/logs/cases/{new_case.id}",
+            "message": new_case.note
+        }))
+    new_case_ids = [new_case.id for new_case in new_cases]
+    db.session.commit()
+
+    for row in latest_rows:
+        mq2_cache.put(row)
+    if last_dhtdata is not None:
+        dht_cache.put(last_dhtdata)
+
+    # делаем рассылку уведомлений; показания уже записаны, поэтому ошибка рассылки
+    # (например, нет VAPID ключа) не должна превращать ответ в 500
+    for message in messages:
+        try:
+            notify_about_warning(message)
+        except Exception as e:
+            print(e)
+
+    return len(rows), new_case_ids
+
+
+def ingest_dht_readings(readings):
+    """
+    Записать пачку показаний DHT одной транзакцией
+    :param readings: List[dict] - {'Temperature', 'Hudimity', 'device_id', 'date_time' (необязательно)}
+    :return: количество записанных показаний
+    """
+    now = datetime.now()
+    rows = [
+        {
+            'temp': reading.get('Temperature'),
+            'hudimity': reading.get('Hudimity'),
+            'device_id': reading.get('device_id'),
+            'date_time': parse_date_time(reading.get('date_time'), now)
+        } for reading in readings
+    ]
+    if rows:
+        rows.sort(key=lambda row: row['date_time'])
+        latest_rows = insert_rows(DHTData, rows)
+        update_rollups(DHTData, rows)
+        db.session.commit()
+        for row in latest_rows:
+            dht_cache.put(row)
+    return len(rows)
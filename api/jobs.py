@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+from api.flask_app import app
+from api.models import db, Job
+from api.utils import JobStatus, open_report_pdf, send_mail_with_attachment
+
+
+def render_report(job):
+    """Сгенерировать PDF отчёта в JOBS_DIR, вернуть имя файла"""
+    from api.config import JOBS_DIR
+
+    params = json.loads(job.params)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    filename = f"report-{params['report_id']}-job-{job.id}.pdf"
+    with open_report_pdf(params['report_id']) as src, open(os.path.join(JOBS_DIR, filename), 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return filename
+
+
+def mail_report(job):
+    params = json.loads(job.params)
+    send_mail_with_attachment(params['report_id'], params['recipient_mail'])
+    return None
+
+
+JOB_HANDLERS = {
+    'report': render_report,
+    'mail': mail_report
+}
+
+# параметры задач и их проверки
+JOB_PARAMS = {
+    'report': {'report_id': lambda value: isinstance(value, int) and not isinstance(value, bool)},
+    'mail': {'report_id': lambda value: isinstance(value, int) and not isinstance(value, bool),
+             'recipient_mail': lambda value: isinstance(value, str) and '@' in value}
+}
+
+
+def validate_job(kind, params):
+    """ValueError, если вид задачи неизвестен или параметры не совпадают с JOB_PARAMS"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    checks = JOB_PARAMS[kind]
+    if set(params) != set(checks):
+        raise ValueError(f"Job {kind} expects parameters {sorted(checks)}, got {sorted(params)}")
+    for name, check in checks.items():
+        if not check(params[name]):
+            raise ValueError(f"Invalid job parameter {name}: {params[name]!r}")
+
+
+class JobQueue:
+    """
+    Очередь задач в таблице Job, которую разбирает пул потоков.
+    Задача захватывается UPDATE ... WHERE status = queued, поэтому очередь можно разбирать из нескольких процессов
+    """
+
+    def __init__(self, app, workers=2, poll_interval=5, timeout=600, result_ttl=86400, results_dir=None):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # сколько секунд хранить завершённые задачи и их файлы в results_dir
+        self.result_ttl = result_ttl
+        self.results_dir = results_dir
+        self.expired_at = 0.0
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.threads = []
+
+    def enqueue(self, kind, **params):
+        validate_job(kind, params)
+        job = Job(kind=kind, params=json.dumps(params), status=JobStatus.queued)
+        db.session.add(job)
+        db.session.commit()
+        self.start()
+        self.wakeup.set()
+        return job
+
+    def find_active(self, kind, **params):
+        """Задача с теми же параметрами, которая ещё в очереди или выполняется"""
+        return Job.query.filter(Job.kind == kind, Job.params == json.dumps(params),
+                                Job.status.in_([JobStatus.queued, JobStatus.running])).order_by(Job.id).first()
+
+    def expire(self):
+        """Удалить завершённые задачи старше result_ttl и файлы результатов старше result_ttl"""
+        cutoff = datetime.now() - timedelta(seconds=self.result_ttl)
+        Job.query.filter(Job.status.in_([JobStatus.done, JobStatus.failed]), Job.finished_at < cutoff) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        if self.results_dir is None or not os.path.isdir(self.results_dir):
+            return
+        for entry in os.scandir(self.results_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def expire_due(self):
+        """Чистка не чаще раза в десятую часть result_ttl, но и не реже раза в час"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.expired_at < min(self.result_ttl / 10, 3600):
+                return
+            self.expired_at = now
+        self.expire()
+
+    def requeue_stale(self):
+        """Вернуть в очередь задачи, зависшие в running дольше timeout (например, после падения процесса)"""
+        deadline = datetime.now() - timedelta(seconds=self.timeout)
+        Job.query.filter(Job.status == JobStatus.running, Job.started_at < deadline) \
+            .update({'status': JobStatus.queued, 'started_at': None}, synchronize_session=False)
+        db.session.commit()
+
+    def claim(self):
+        while True:
+            job_id = db.session.query(Job.id).filter(Job.status == JobStatus.queued).order_by(Job.id).limit(1).scalar()
+            if job_id is None:
+                return None
+            claimed = Job.query.filter(Job.id == job_id, Job.status == JobStatus.queued) \
+                .update({'status': JobStatus.running, 'started_at': datetime.now()}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return Job.query.get(job_id)
+
+    def run(self, job):
+        try:
+            job.result_filename = JOB_HANDLERS[job.kind](job)
+            job.status = JobStatus.done
+        except Exception as e:
+            print(e)
+            db.session.rollback()
+            job.status = JobStatus.failed
+            job.error = str(e)
+        job.finished_at = datetime.now()
+        db.session.commit()
+
+    def work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    job = self.claim()
+                    if job is not None:
+                        self.run(job)
+                        continue
+                    if self.result_ttl:
+                        self.expire_due()
+            except Exception as e:
+                print(e)
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def start(self):
+        # без потоков (JOB_WORKERS=0) задачи разбирает другой процесс, ему и возвращать зависшие
+        if not self.workers:
+            return
+        with self.lock:
+            if self.threads:
+                return
+            try:
+                with self.app.app_context():
+                    self.requeue_stale()
+            except Exception as e:
+                # ошибка базы не должна ронять первый запрос приложения, задачи вернутся при следующем запуске
+                print(e)
+            for i in range(self.workers):
+                thread = Thread(target=self.work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+
+job_queue = None
+
+
+def get_job_queue():
+    global job_queue
+    if job_queue is None:
+        from api.config import JOB_WORKERS, JOB_POLL_INTERVAL, JOB_TIMEOUT, JOB_RESULT_TTL, JOBS_DIR
+
+        job_queue = JobQueue(app, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL, timeout=JOB_TIMEOUT,
+                             result_ttl=JOB_RESULT_TTL, results_dir=JOBS_DIR)
+    return job_queue
+
+
+@app.before_first_request
+def start_job_workers():
+    get_job_queue().start()
@@ -1,80 +1,256 @@
 # https://www.pyimagesearch.com/2016/02/29/saving-key-event-video-clips-with-opencv/
 # import the necessary packages
 import time
-from collections import deque
-from queue import Queue
+from queue import Queue, Empty, Full
 from threading import Thread
 
 import cv2
+import numpy as np
+
+# what to do with a new frame when the writer queue is full
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+BLOCK = "block"
 
 
 class KeyClipWriter:
-    def __init__(self, bufSize=64, timeout=1.0):
+    def __init__(self, bufSize=64, timeout=1.0, queueSize=128, dropPolicy=DROP_OLDEST, jpegQuality=None,
+                 onFinish=None):
         # store the maximum buffer size of frames to be kept
-        # in memory along with the sleep timeout during threading
+        # in memory along with the timeout the writer thread waits
+        # for a frame and the capture loop waits on a full queue
         self.bufSize = bufSize
         self.timeout = timeout
-        # initialize the buffer of frames, queue of frames that
-        # need to be written to file, video writer, writer thread,
+        self.queueSize = queueSize
+        self.dropPolicy = dropPolicy
+        # pre-roll frames are kept as JPEG of this quality instead
+        # of raw BGR frames, None - keep raw frames
+        self.jpegQuality = jpegQuality
+        # called with the output path once a clip file is complete
+        # and released, e.g. to build its thumbnail
+        self.onFinish = onFinish
+        self.outputs = {}
+        # initialize the pre-roll ring buffer (allocated on the first
+        # frame, when the frame size is known), bounded queue of frames
+        # that need to be written to file, video writer, writer thread,
         # and boolean indicating whether recording has started or not
-        self.frames = deque(maxlen=bufSize)
+        self.ring = None
+        self.head = 0
+        self.count = 0
         self.Q = None
         self.writer = None
+        # writers of the current recording in the order the segments
+        # were opened
+        self.writers = []
         self.thread = None
         self.recording = False
+        self.resetStats()
+
+    def resetStats(self):
+        self.written = 0
+        self.dropped = 0
+        self.maxQueueDepth = 0
+        self.latencySamples = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+
+    def allocate(self, frame):
+        # preallocate the ring buffer for raw frames, or a list
+        # of encoded buffers for compressed pre-roll
+        if self.jpegQuality is None:
+            self.ring = np.empty((self.bufSize,) + frame.shape, dtype=frame.dtype)
+        else:
+            self.ring = [None] * self.bufSize
+        self.head = 0
+        self.count = 0
+
+    def store(self, frame):
+        # put the frame into the ring buffer slot, overwriting the oldest one
+        if self.jpegQuality is None:
+            if self.ring is None or self.ring.shape[1:] != frame.shape:
+                self.allocate(frame)
+            np.copyto(self.ring[self.head], frame)
+        else:
+            if self.ring is None:
+                self.allocate(frame)
+            _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpegQuality])
+            self.ring[self.head] = (buffer, frame.shape)
+        self.head = (self.head + 1) % self.bufSize
+        self.count = min(self.count + 1, self.bufSize)
+
+    def preroll(self, limit=None):
+        # the last `limit` pre-roll frames from the oldest to the newest,
+        # copied out of the ring buffer so the capture loop can keep
+        # overwriting it
+        count = self.count if limit is None else max(0, min(self.count, limit))
+        start = (self.head - count) % self.bufSize
+        order = [(start + i) % self.bufSize for i in range(count)]
+        if self.jpegQuality is None:
+            return self.ring[order] if count else []
+        return [self.ring[i] for i in order]
+
+    def frameSize(self):
+        # width and height of the frames kept in the ring buffer
+        if self.jpegQuality is None:
+            return self.ring.shape[2], self.ring.shape[1]
+        _, shape = self.ring[(self.head - 1) % self.bufSize]
+        return shape[1], shape[0]
+
+    def enqueue(self, frame):
+        # add the frame to the writer queue following the drop policy,
+        # so a slow disk can't make the queue grow without bound
+        item = (frame, time.monotonic(), self.writer)
+        try:
+            if self.dropPolicy == BLOCK:
+                self.Q.put(item, timeout=self.timeout)
+            else:
+                self.Q.put_nowait(item)
+        except Full:
+            self.dropped += 1
+            if self.dropPolicy == DROP_OLDEST:
+                try:
+                    self.Q.get_nowait()
+                    self.Q.put_nowait(item)
+                except (Empty, Full):
+                    pass
+        self.maxQueueDepth = max(self.maxQueueDepth, self.Q.qsize())
 
     def update(self, frame):
         # update the frames buffer
-        self.frames.appendleft(frame)
+        self.store(frame)
         # if we are recording, update the queue as well
         if self.recording:
-            self.Q.put(frame)
+            self.enqueue(frame)
 
-    def start(self, outputPath, fourcc, fps):
+    def start(self, outputPath, fourcc, fps, prerollFrames=None):
         # indicate that we are recording, start the video writer,
         # and initialize the queue of frames that need to be written
         # to the video file
         self.recording = True
-        self.writer = cv2.VideoWriter(outputPath, fourcc, fps,
-                                      (self.frames[0].shape[1], self.frames[0].shape[0]), True)
-        self.Q = Queue()
-        # loop over the frames in the deque structure and add them
-        # to the queue
-        for i in range(len(self.frames), 0, -1):
-            self.Q.put(self.frames[i - 1])
-        # start a thread write frames to the video file
-        self.thread = Thread(target=self.write, args=())
+        self.resetStats()
+        self.writer = cv2.VideoWriter(outputPath, fourcc, fps, self.frameSize(), True)
+        self.outputs[self.writer] = outputPath
+        self.writers = [self.writer]
+        self.Q = Queue(maxsize=self.queueSize)
+        # start a thread write the pre-roll and then the queued
+        # frames to the video file
+        self.thread = Thread(target=self.write, args=(self.preroll(prerollFrames), self.writer, self.Q, self.writers))
         self.thread.daemon = True
         self.thread.start()
 
-    def write(self):
-        # keep looping
+    def rotate(self, outputPath, fourcc, fps):
+        # continue the recording in a new file; every queued frame
+        # carries its writer, so the writer thread closes the previous
+        # file once all of its frames are written and the capture loop
+        # doesn't wait for it
+        self.writer = cv2.VideoWriter(outputPath, fourcc, fps, self.frameSize(), True)
+        self.outputs[self.writer] = outputPath
+        self.writers.append(self.writer)
+
+    def release(self, writer):
+        # close the file and hand its path to the onFinish callback
+        writer.release()
+        outputPath = self.outputs.pop(writer, None)
+        if self.onFinish is not None and outputPath is not None:
+            self.onFinish(outputPath)
+
+    def releaseBefore(self, writers, writer, frame, written):
+        # release every file of the recording opened before `writer`
+        # (all of them if it is None), including segments whose frames
+        # were all dropped from a full queue: such a segment gets `frame`
+        # so its file still plays
+        end = len(writers) if writer is None else writers.index(writer)
+        for previous in writers[:end]:
+            if previous in self.outputs:
+                if not written.get(previous) and frame is not None:
+                    self.writeFrame(frame, previous)
+                self.release(previous)
+
+    def writeFrame(self, frame, writer):
+        if self.jpegQuality is not None and isinstance(frame, tuple):
+            frame = cv2.imdecode(frame[0], cv2.IMREAD_COLOR)
+        writer.write(frame)
+        self.written += 1
+
+    def write(self, preroll, writer, Q, writers):
+        # write the frames buffered before the recording started,
+        # counting the frames that went to each file
+        last = None
+        for last in preroll:
+            self.writeFrame(last, writer)
+        written = {writer: len(preroll)}
+        # keep looping, blocking until the next frame arrives;
+        # None in the queue means the recording is finished
         while True:
-            # if we are done recording, exit the thread
-            if not self.recording:
+            try:
+                item = Q.get(timeout=self.timeout)
+            except Empty:
+                continue
+            if item is None:
+                # the thread closes the files itself, so finish()
+                # doesn't have to wait for a slow disk
+                self.releaseBefore(writers, None, last, written)
                 return
-            # check to see if there are entries in the queue
-            if not self.Q.empty():
-                # grab the next frame in the queue and write it
-                # to the video file
-                frame = self.Q.get()
-                self.writer.write(frame)
-            # otherwise, the queue is empty, so sleep for a bit
-            # so we don't waste CPU cycles
-            else:
-                time.sleep(self.timeout)
+            frame, queuedAt, frameWriter = item
+            if frameWriter is not writer:
+                # the recording was rotated, the previous files are complete
+                self.releaseBefore(writers, frameWriter, frame, written)
+                writer = frameWriter
+            self.writeFrame(frame, writer)
+            written[writer] = written.get(writer, 0) + 1
+            last = frame
+            latency = time.monotonic() - queuedAt
+            self.latencySamples += 1
+            self.totalLatency += latency
+            self.maxLatency = max(self.maxLatency, latency)
 
     def flush(self):
         # empty the queue by flushing all remaining frames to file
-        while not self.Q.empty():
-            frame = self.Q.get()
-            self.writer.write(frame)
+        while True:
+            try:
+                item = self.Q.get_nowait()
+            except Empty:
+                return
+            if item is not None:
+                self.writeFrame(item[0], item[2])
 
     def finish(self):
-        # indicate that we are done recording, join the thread,
-        # flush all remaining frames in the queue to file, and
-        # release the writer pointer
+        # indicate that we are done recording and put the end marker
+        # into the queue; a full queue follows the drop policy instead
+        # of blocking the capture loop on a stalled writer thread
         self.recording = False
-        self.thread.join()
-        self.flush()
-        self.writer.release()
+        try:
+            self.Q.put(None, timeout=self.timeout)
+        except Full:
+            try:
+                self.Q.get_nowait()
+                self.dropped += 1
+            except Empty:
+                pass
+            try:
+                self.Q.put_nowait(None)
+            except Full:
+                pass
+        # wait a bounded time for the thread; if it is still writing
+        # it releases the file when it reaches the end marker
+        self.thread.join(timeout=self.timeout)
+        if self.thread.is_alive():
+            return
+        # the thread died before the end marker: write what is left
+        # and release the files it didn't
+        if self.writer in self.outputs:
+            self.flush()
+            for writer in self.writers:
+                if writer in self.outputs:
+                    self.release(writer)
+
+    def stats(self):
+        return {
+            'recording': self.recording,
+            'queue_depth': self.Q.qsize() if self.Q is not None else 0,
+            'max_queue_depth': self.maxQueueDepth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'avg_write_latency': self.totalLatency / self.latencySamples if self.latencySamples else None,
+            'max_write_latency': self.maxLatency
+        }
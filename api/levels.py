@@ -0,0 +1,85 @@
+from bisect import bisect_right
+
+import numpy as np
+
+GASES = ('lpg', 'co', 'smoke')
+
+# пороги low, moderate, danger, emergency в ppm
+DEFAULT_THRESHOLDS = {
+    'lpg': (5500, 6900, 10000, 18000),
+    'co': (10, 24, 50, 400),
+    'smoke': (10, 24, 50, 400)
+}
+
+
+class ThresholdTable:
+    """
+    Таблица порогов уровня опасности по газам, с переопределением для отдельных устройств.
+    Уровни - полуоткрытые интервалы: [low, moderate) -> 1, [moderate, danger) -> 2,
+    [danger, emergency) -> 3, [emergency, +inf) -> 4, ниже low -> 0
+    """
+
+    def __init__(self, default=None, devices=None):
+        self.default = {gas: tuple(thresholds) for gas, thresholds in DEFAULT_THRESHOLDS.items()}
+        self.default.update({gas: tuple(thresholds) for gas, thresholds in (default or {}).items()})
+        self.devices = {}
+        for device_id, device_thresholds in (devices or {}).items():
+            thresholds = dict(self.default)
+            thresholds.update({gas: tuple(values) for gas, values in device_thresholds.items()})
+            self.devices[int(device_id)] = thresholds
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: dict вида {"lpg": [...], "co": [...], "devices": {"<device_id>": {"co": [...]}}}
+        """
+        config = dict(config)
+        devices = config.pop('devices', None)
+        return cls(default=config, devices=devices)
+
+    def thresholds(self, gas, device_id=None):
+        return self.devices.get(device_id, self.default)[gas]
+
+    def level(self, gas, value, device_id=None):
+        if value is None:
+            return 0
+        return bisect_right(self.thresholds(gas, device_id), value)
+
+    def classify(self, gas, values, device_id=None):
+        """Уровни для массива значений одного газа"""
+        values = np.asarray(values, dtype=float)
+        levels = np.searchsorted(np.asarray(self.thresholds(gas, device_id)), values, side='right')
+        levels[np.isnan(values)] = 0
+        return levels
+
+    def check(self, lpg_value, co_value, smoke_value, device_id=None):
+        return max(self.level('lpg', lpg_value, device_id),
+                   self.level('co', co_value, device_id),
+                   self.level('smoke', smoke_value, device_id))
+
+    def check_batch(self, lpg_values, co_values, smoke_values, device_ids=None):
+        """Общий уровень для массивов показаний; device_ids - массив id устройств или None"""
+        values = {'lpg': lpg_values, 'co': co_values, 'smoke': smoke_values}
+        levels = np.maximum.reduce([self.classify(gas, values[gas]) for gas in GASES])
+        if device_ids is None or not self.devices:
+            return levels
+
+        device_ids = np.asarray(device_ids, dtype=object)
+        for device_id in self.devices:
+            mask = device_ids == device_id
+            if mask.any():
+                levels[mask] = np.maximum.reduce([
+                    self.classify(gas, np.asarray(values[gas], dtype=float)[mask], device_id) for gas in GASES
+                ])
+        return levels
+
+
+thresholds = None
+
+
+def get_thresholds():
+    global thresholds
+    if thresholds is None:
+        from api.config import GAS_THRESHOLDS
+        thresholds = ThresholdTable.from_config(GAS_THRESHOLDS)
+    return thresholds
@@ -0,0 +1,217 @@
+import json
+import logging
+import re
+import time
+from collections import deque
+from threading import Lock
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# границы корзин гистограмм в секундах, как у клиентов Prometheus по умолчанию
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+request_log = logging.getLogger('api.requests')
+sql_log = logging.getLogger('api.sql')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = (f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        # labels -> [счётчики по корзинам..., count, sum]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ('le',)
+        with self.lock:
+            for labels, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + ('+Inf',))} {counts[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {counts[-1]:.6f}")
+        return lines
+
+
+request_latency = Histogram('http_request_duration_seconds', 'Время обработки запроса до отправки тела ответа',
+                            ('method', 'endpoint', 'status'))
+request_statements = Histogram('http_request_sql_statements', 'SQL запросов на один HTTP запрос',
+                               ('method', 'endpoint'), buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250))
+sql_duration = Histogram('sql_statement_duration_seconds', 'Время выполнения SQL запросов', ('endpoint',))
+sql_errors = Counter('sql_statement_errors_total', 'SQL запросы, завершившиеся ошибкой', ('endpoint',))
+slow_queries = Counter('sql_slow_statements_total', 'SQL запросы дольше SLOW_QUERY_MS', ('endpoint',))
+
+REGISTRY = [request_latency, request_statements, sql_duration, sql_errors, slow_queries]
+
+# последние медленные запросы для разбора без доступа к логам
+recent_slow_queries = deque(maxlen=100)
+
+SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SQL_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """SQL без литералов и с одним ? вместо списков IN: одинаковые запросы с разными параметрами совпадают"""
+    statement = SQL_STRING.sub('?', statement)
+    statement = SQL_NUMBER.sub('?', statement)
+    statement = SQL_IN_LIST.sub('(?...)', statement)
+    return SQL_SPACE.sub(' ', statement).strip()
+
+
+def current_endpoint():
+    """Метка запроса: шаблон маршрута, а не URL, чтобы id в пути не плодили ряды метрик"""
+    if not has_request_context():
+        return 'background'
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+
+def exposition():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def init_sql_metrics(engine, slow_query_ms):
+    """Счётчики и время SQL запросов через события движка SQLAlchemy"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        endpoint = current_endpoint()
+        sql_duration.observe(elapsed, endpoint)
+        if has_request_context():
+            g.sql_statements = g.get('sql_statements', 0) + 1
+            g.sql_time = g.get('sql_time', 0.0) + elapsed
+
+        if elapsed * 1000 >= slow_query_ms:
+            slow_queries.inc(endpoint)
+            entry = {
+                'event': 'slow_query',
+                'endpoint': endpoint,
+                'duration_ms': round(elapsed * 1000, 3),
+                'statement': normalize_sql(statement),
+                'executemany': executemany
+            }
+            recent_slow_queries.append(entry)
+            sql_log.warning(json.dumps(entry))
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        start = context.connection.info.get('query_start') if context.connection is not None else None
+        if start:
+            start.pop()
+        sql_errors.inc(current_endpoint())
+        sql_log.error(json.dumps({
+            'event': 'sql_error',
+            'endpoint': current_endpoint(),
+            'statement': normalize_sql(context.statement or ''),
+            'error': str(context.original_exception)
+        }))
+
+
+def init_request_metrics(app, log_requests):
+    """Время и число SQL запросов на каждый HTTP запрос, по шаблону маршрута"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = current_endpoint()
+        statements = g.get('sql_statements', 0)
+        request_latency.observe(elapsed, request.method, endpoint, response.status_code)
+        request_statements.observe(statements, request.method, endpoint)
+        if log_requests:
+            request_log.info(json.dumps({
+                'event': 'request',
+                'method': request.method,
+                'endpoint': endpoint,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 3),
+                'sql_statements': statements,
+                'sql_ms': round(g.get('sql_time', 0.0) * 1000, 3)
+            }))
+        return response
+
+
+def init_log(logger):
+    """Структурированный лог: одна JSON строка на событие в stderr"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def init_metrics(app, engine, slow_query_ms=100, log_requests=False):
+    init_log(request_log)
+    init_log(sql_log)
+    init_sql_metrics(engine, slow_query_ms)
+    init_request_metrics(app, log_requests)
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from api.utils import LevelType
+from api.utils import LevelType, JobStatus
 from .flask_app import db
 
 
@@ -47,6 +47,15 @@ class MQ2Data(db.Model):
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=True)
     device_id = db.Column(db.Integer, db.ForeignKey('device.id'))
 
+    __table_args__ = (
+        db.Index('ix_mq2_data_device_id_date_time', 'device_id', 'date_time'),
+        db.Index('ix_mq2_data_date_time_id', 'date_time', 'id'),
+        db.Index('ix_mq2_data_case_id_id', 'case_id', 'id'),
+        # id удалённых строк не используются повторно: архив показаний (api.archive) считает строки
+        # с id больше своего max_id дописанными после архивации
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f'<MQ2Data: DateTime: {self.date_time} - LPG: {self.lpg} - CO: {self.co} - Smoke: {self.smoke}' \
                f' - Device: {self.device_id}> '
@@ -64,6 +73,13 @@ class DHTData(db.Model):
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=True)
     device_id = db.Column(db.Integer, db.ForeignKey('device.id'))
 
+    __table_args__ = (
+        db.Index('ix_dht_data_device_id_date_time', 'device_id', 'date_time'),
+        db.Index('ix_dht_data_date_time_id', 'date_time', 'id'),
+        # id удалённых строк не используются повторно, см. MQ2Data
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f'<DHTData: DateTime: {self.date_time} - Temperature: {self.temp} - Hudimity: {self.hudimity}>'
 
@@ -71,9 +87,68 @@ class DHTData(db.Model):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+class MQ2Rollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    device_id = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False)
+    lpg_min = db.Column(db.Integer, nullable=False)
+    lpg_max = db.Column(db.Integer, nullable=False)
+    lpg_sum = db.Column(db.BigInteger, nullable=False)
+    co_min = db.Column(db.Integer, nullable=False)
+    co_max = db.Column(db.Integer, nullable=False)
+    co_sum = db.Column(db.BigInteger, nullable=False)
+    smoke_min = db.Column(db.Integer, nullable=False)
+    smoke_max = db.Column(db.Integer, nullable=False)
+    smoke_sum = db.Column(db.BigInteger, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('resolution', 'device_id', 'bucket'),
+        db.Index('ix_mq2_rollup_resolution_bucket', 'resolution', 'bucket'),
+    )
+
+    def __repr__(self):
+        return f'<MQ2Rollup: Resolution: {self.resolution} - Bucket: {self.bucket} - Device: {self.device_id}>'
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class DHTRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    device_id = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False)
+    temp_min = db.Column(db.Integer, nullable=False)
+    temp_max = db.Column(db.Integer, nullable=False)
+    temp_sum = db.Column(db.BigInteger, nullable=False)
+    hudimity_min = db.Column(db.Integer, nullable=False)
+    hudimity_max = db.Column(db.Integer, nullable=False)
+    hudimity_sum = db.Column(db.BigInteger, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('resolution', 'device_id', 'bucket'),
+        db.Index('ix_dht_rollup_resolution_bucket', 'resolution', 'bucket'),
+    )
+
+    def __repr__(self):
+        return f'<DHTRollup: Resolution: {self.resolution} - Bucket: {self.bucket} - Device: {self.device_id}>'
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
 class Camera(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     location = db.Column(db.Text)
+    # индекс устройства, путь к файлу или RTSP/HTTP URL
+    source = db.Column(db.Text, nullable=True)
+    # включённые детекторы через запятую (face,fire,person), NULL - все
+    detectors = db.Column(db.Text, nullable=True)
+    # области поиска огня, JSON: [[x, y, w, h], ...] в долях кадра, NULL - весь кадр
+    fire_roi = db.Column(db.Text, nullable=True)
 
     log = db.relationship('Log', backref='camera')
 
@@ -94,6 +169,10 @@ class Log(db.Model):
     report = db.relationship('Report', backref='log')
     notification = db.relationship('Notification', backref='log')
 
+    __table_args__ = (
+        db.Index('ix_log_date_time_id', 'date_time', 'id'),
+    )
+
     def __repr__(self):
         return f'<Log: DateTime {self.date_time} - Camera: {self.camera}>'
 
@@ -109,6 +188,10 @@ class Report(db.Model):
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=True)
     log_id = db.Column(db.Integer, db.ForeignKey('log.id'), nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_report_created_at_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Report: DateTime: {self.created_at} - Content: {self.content}>'
 
@@ -144,3 +227,25 @@ class Subscriber(db.Model):
 
     def as_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.queued)
+    params = db.Column(db.Text, nullable=False)
+    result_filename = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Job: id: {self.id} - Kind: {self.kind} - Status: {self.status}>'
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
@@ -0,0 +1,140 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, local
+from urllib.parse import urlparse
+
+import requests
+from py_vapid import Vapid
+from pywebpush import WebPusher
+
+# подписка больше не действительна, её нужно удалить
+EXPIRED_STATUS_CODES = (404, 410)
+# временные ошибки сервиса рассылки, отправку можно повторить
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def push_service_origin(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+class VapidSigner:
+    """
+    VAPID заголовки для сервисов рассылки. Ключ разбирается один раз, подписанный JWT
+    кэшируется на origin сервиса рассылки и переподписывается незадолго до истечения
+    """
+
+    def __init__(self, private_key, claims, lifetime=12 * 60 * 60, refresh_margin=10 * 60):
+        self.private_key = private_key
+        self.claims = claims
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.vapid = None
+        self.lock = Lock()
+        self.signed = {}
+
+    def headers(self, endpoint):
+        origin = push_service_origin(endpoint)
+        now = time.time()
+        with self.lock:
+            cached = self.signed.get(origin)
+            if cached is not None and cached[1] - self.refresh_margin > now:
+                return dict(cached[0])
+
+            if self.vapid is None:
+                self.vapid = Vapid.from_string(private_key=self.private_key)
+            claims = dict(self.claims)
+            claims['aud'] = origin
+            claims['exp'] = int(now) + self.lifetime
+            headers = self.vapid.sign(claims)
+            self.signed[origin] = (headers, claims['exp'])
+            return dict(headers)
+
+
+class PushDispatcher:
+    """
+    Рассылка web push уведомлений в пуле потоков: ограниченное число одновременных отправок,
+    свой requests.Session на поток (keep-alive к сервисам рассылки), таймаут и повторы с backoff.
+    Подписки, на которые сервис ответил 404/410, удаляются
+    """
+
+    def __init__(self, app, signer, max_workers=8, timeout=10, retries=3, backoff=0.5, ttl=0):
+        self.app = app
+        self.signer = signer
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='push')
+        self.local = local()
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def send(self, subscription_info, message):
+        """
+        Отправить одно уведомление с повторами
+        :return: HTTP статус последней попытки или None, если сервис так и не ответил
+        """
+        status_code = None
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = WebPusher(subscription_info, requests_session=self.session).send(
+                    message, headers=self.signer.headers(subscription_info['endpoint']),
+                    ttl=self.ttl, timeout=self.timeout)
+                status_code = response.status_code
+                if status_code not in RETRY_STATUS_CODES:
+                    return status_code
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            except requests.RequestException as e:
+                print(e)
+            if attempt < self.retries:
+                time.sleep(delay)
+        return status_code
+
+    def deliver(self, subscription_info, message):
+        try:
+            status_code = self.send(subscription_info, message)
+            if status_code in EXPIRED_STATUS_CODES:
+                self.remove_subscription(subscription_info['endpoint'])
+            elif status_code is None or status_code > 202:
+                print(f"[WARNING] - Web push to {subscription_info['endpoint']} failed: {status_code}")
+            return status_code
+        except Exception as e:
+            print(e)
+
+    def remove_subscription(self, endpoint):
+        from api.models import db, Subscriber
+
+        with self.app.app_context():
+            Subscriber.query.filter_by(endpoint=endpoint).delete()
+            db.session.commit()
+
+    def submit(self, subscriptions, message):
+        """Поставить рассылку в очередь и сразу вернуть управление; возвращает futures со статусами"""
+        return [self.executor.submit(self.deliver, subscription_info, message) for subscription_info in subscriptions]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+dispatcher = None
+
+
+def get_dispatcher():
+    global dispatcher
+    if dispatcher is None:
+        from api.config import PUSH_WORKERS, PUSH_TIMEOUT, PUSH_RETRIES, PUSH_BACKOFF, PUSH_TTL, \
+            VAPID_PRIVATE_KEY, VAPID_CLAIMS
+        from api.flask_app import app
+
+        signer = VapidSigner(VAPID_PRIVATE_KEY, VAPID_CLAIMS)
+        dispatcher = PushDispatcher(app, signer, max_workers=PUSH_WORKERS, timeout=PUSH_TIMEOUT, retries=PUSH_RETRIES,
+                                    backoff=PUSH_BACKOFF, ttl=PUSH_TTL)
+    return dispatcher
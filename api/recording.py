@@ -0,0 +1,117 @@
+import os
+import time
+from datetime import datetime
+
+import cv2
+
+IDLE = 'idle'
+RECORDING = 'recording'
+POST_ROLL = 'post_roll'
+
+
+class EventRecorder:
+    """
+    Запись клипов по событиям поверх KeyClipWriter:
+    - idle: кадры только попадают в буфер pre-roll;
+    - recording: событие идёт, клип начинается с последних preroll секунд до события;
+    - post_roll: событие закончилось, запись продолжается ещё postroll секунд и останавливается,
+      если событие не возобновилось.
+    Длинное событие режется на сегменты по segment_seconds, закрытый сегмент сразу можно воспроизводить.
+    fps файла - измеренная частота кадров захвата, а не фиксированные 30
+    """
+
+    def __init__(self, writer, directory, prefix='fire', preroll=2.0, postroll=5.0, segment_seconds=60.0,
+                 fourcc='H264', on_segment=None, clock=time.monotonic):
+        self.writer = writer
+        self.directory = directory
+        self.prefix = prefix
+        self.preroll = preroll
+        self.postroll = postroll
+        self.segment_seconds = segment_seconds
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        # callback(filename, segment_index) при начале каждого сегмента
+        self.on_segment = on_segment
+        self.clock = clock
+        self.state = IDLE
+        self.fps = None
+        self.last_frame_time = None
+        self.last_active = None
+        self.event_started = None
+        self.segment_started = None
+        self.segment_index = 0
+        self.filename = None
+        self.events = 0
+        self.segments = 0
+
+    def measure(self, now):
+        """Частота кадров захвата: скользящее среднее интервалов между кадрами"""
+        if self.last_frame_time is not None and now > self.last_frame_time:
+            fps = 1 / (now - self.last_frame_time)
+            self.fps = fps if self.fps is None else 0.9 * self.fps + 0.1 * fps
+        self.last_frame_time = now
+
+    def writer_fps(self):
+        return round(self.fps, 1) if self.fps else 30.0
+
+    def segment_filename(self):
+        timestamp = datetime.now()
+        return f"{self.prefix}-{timestamp.strftime('%m-%d-%Y %H-%M-%S')}-{self.segment_index:03d}.mp4"
+
+    def begin_segment(self, now):
+        self.segment_started = now
+        self.filename = self.segment_filename()
+        self.segments += 1
+        if self.on_segment is not None:
+            self.on_segment(self.filename, self.segment_index)
+        return os.path.join(self.directory, self.filename)
+
+    def start_event(self, now):
+        self.state = RECORDING
+        self.events += 1
+        self.event_started = self.last_active = now
+        self.segment_index = 0
+        path = self.begin_segment(now)
+        self.writer.start(path, self.fourcc, self.writer_fps(), prerollFrames=int(self.preroll * self.writer_fps()))
+
+    def rotate(self, now):
+        self.segment_index += 1
+        self.writer.rotate(self.begin_segment(now), self.fourcc, self.writer_fps())
+
+    def finish(self):
+        if self.writer.recording:
+            self.writer.finish()
+        self.state = IDLE
+        self.filename = None
+
+    def update(self, frame, active):
+        """
+        :param frame: кадр с разметкой
+        :param active: есть ли событие (например, огонь) в этом кадре
+        """
+        now = self.clock()
+        self.measure(now)
+
+        if self.state == IDLE:
+            self.writer.update(frame)
+            if active:
+                # текущий кадр уже в буфере и станет последним кадром pre-roll
+                self.start_event(now)
+            return
+
+        if active:
+            self.state = RECORDING
+            self.last_active = now
+        elif now - self.last_active >= self.postroll:
+            self.writer.update(frame)
+            self.finish()
+            return
+        else:
+            self.state = POST_ROLL
+
+        if now - self.segment_started >= self.segment_seconds:
+            self.rotate(now)
+        self.writer.update(frame)
+
+    def stats(self):
+        return dict(self.writer.stats(), state=self.state, fps=self.fps, filename=self.filename,
+                    events=self.events, segments=self.segments)
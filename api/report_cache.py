@@ -0,0 +1,119 @@
+import hashlib
+import io
+import json
+import os
+import uuid
+from threading import Lock
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Дисковый кэш артефактов отчётов (PDF, SVG графиков, QR кодов) по ключу-хэшу содержимого.
+    Размер ограничен max_bytes, при переполнении удаляются давно не использованные файлы (LRU по mtime)
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def get_path(self, key, ext):
+        path = self.path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key, ext):
+        path = self.get_path(key, ext)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, ext, data):
+        path = self.path(key, ext)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def get_or_create(self, key, ext, build):
+        data = self.get(key, ext)
+        if data is None:
+            data = build()
+            self.put(key, ext, data)
+        return data
+
+    def open_file(self, path):
+        """Открыть файл под блокировкой вытеснения: открытый файл переживает удаление, путь - нет"""
+        with self.lock:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return None
+            os.utime(path)
+            return f
+
+    def open(self, key, ext, build=None):
+        """
+        Открытый файл артефакта, build() строит его при отсутствии.
+        В отличие от пути, файл нельзя потерять между поиском в кэше и чтением
+        :return: бинарный файловый объект или None, если артефакта нет и build не задан
+        """
+        path = self.path(key, ext)
+        f = self.open_file(path)
+        if f is not None or build is None:
+            return f
+        data = build()
+        self.put(key, ext, data)
+        f = self.open_file(path)
+        # артефакт больше всего кэша вытеснен сразу после записи
+        return f if f is not None else io.BytesIO(data)
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+
+report_cache = None
+
+
+def get_report_cache():
+    global report_cache
+    if report_cache is None:
+        from api.config import REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES
+
+        report_cache = ArtifactCache(REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES)
+    return report_cache
@@ -0,0 +1,308 @@
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from threading import Thread
+
+import click
+import numpy as np
+from sqlalchemy import bindparam, func, text
+
+from api.downsampling import SENSOR_FIELDS, COLUMN_DTYPES, to_epoch, from_epoch, downsample, rebucket, \
+    pick_bucket, epoch_seconds, fetch_columns, filter_series
+from api.flask_app import app
+from api.models import db, MQ2Data, DHTData, MQ2Rollup, DHTRollup
+
+# минутные, часовые и суточные агрегаты
+RESOLUTIONS = (60, 3600, 86400)
+
+ROLLUP_MODELS = {
+    'MQ2Data': MQ2Rollup,
+    'DHTData': DHTRollup
+}
+
+upsert_statements = {}
+
+
+def upsert_statement(model):
+    """INSERT ... ON CONFLICT DO UPDATE, понимают и SQLite (>= 3.24), и PostgreSQL"""
+    if model.__name__ in upsert_statements:
+        return upsert_statements[model.__name__]
+
+    table = ROLLUP_MODELS[model.__name__].__tablename__
+    columns = ['resolution', 'bucket', 'device_id', 'count']
+    updates = [f'count = {table}.count + excluded.count']
+    for field in SENSOR_FIELDS[model.__name__]:
+        columns += [f'{field}_min', f'{field}_max', f'{field}_sum']
+        updates += [
+            f'{field}_min = CASE WHEN excluded.{field}_min < {table}.{field}_min '
+            f'THEN excluded.{field}_min ELSE {table}.{field}_min END',
+            f'{field}_max = CASE WHEN excluded.{field}_max > {table}.{field}_max '
+            f'THEN excluded.{field}_max ELSE {table}.{field}_max END',
+            f'{field}_sum = {table}.{field}_sum + excluded.{field}_sum'
+        ]
+    statement = text(f"INSERT INTO {table} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join(':' + column for column in columns)}) "
+                     f"ON CONFLICT (resolution, device_id, bucket) DO UPDATE SET {', '.join(updates)}")
+    statement = statement.bindparams(bindparam('bucket', type_=db.DateTime))
+    upsert_statements[model.__name__] = statement
+    return statement
+
+
+def rollup_params(model, device_id, timestamps, values):
+    """Параметры upsert_statement для показаний одного устройства, timestamps отсортированы"""
+    fields = SENSOR_FIELDS[model.__name__]
+    params = []
+    for resolution in RESOLUTIONS:
+        bucket_starts, counts, aggregates = downsample(timestamps, values, resolution)
+        for i, bucket in enumerate(from_epoch(bucket_starts)):
+            param = {'resolution': resolution, 'bucket': bucket, 'device_id': device_id, 'count': int(counts[i])}
+            for field in fields:
+                param[f'{field}_min'] = int(aggregates[field]['min'][i])
+                param[f'{field}_max'] = int(aggregates[field]['max'][i])
+                param[f'{field}_sum'] = int(aggregates[field]['sum'][i])
+            params.append(param)
+    return params
+
+
+def update_rollups(model, rows):
+    """
+    Добавить записанные показания в агрегаты всех уровней. Выполняется в текущей транзакции
+    :param rows: List[dict] - строки с date_time, device_id и полями датчика
+    """
+    fields = SENSOR_FIELDS[model.__name__]
+    by_device = defaultdict(list)
+    for row in rows:
+        by_device[row['device_id'] or 0].append(row)
+
+    params = []
+    for device_id, device_rows in by_device.items():
+        timestamps = to_epoch([row['date_time'] for row in device_rows])
+        order = np.argsort(timestamps, kind='stable')
+        values = {field: np.array([row[field] for row in device_rows])[order] for field in fields}
+        params += rollup_params(model, device_id, timestamps[order], values)
+
+    if params:
+        db.session.execute(upsert_statement(model), params)
+
+
+def filter_rollups(query, rollup, resolution, date_from=None, date_to=None, device_id=None):
+    query = query.filter(rollup.resolution == resolution)
+    if device_id is not None:
+        query = query.filter(rollup.device_id == device_id)
+    if date_from is not None:
+        query = query.filter(rollup.bucket > date_from - timedelta(seconds=resolution))
+    if date_to is not None:
+        query = query.filter(rollup.bucket < date_to)
+    return query
+
+
+def load_rollups(model, resolution, date_from=None, date_to=None, device_id=None):
+    """
+    Агрегаты одного уровня за период, без device_id - суммарно по всем устройствам
+    :return: Tuple(начала интервалов, количество точек, Dict[поле, Dict['min'|'max'|'sum', np.ndarray]])
+    """
+    rollup = ROLLUP_MODELS[model.__name__]
+    fields = SENSOR_FIELDS[model.__name__]
+    columns = [rollup.bucket, func.sum(rollup.count)]
+    for field in fields:
+        columns += [func.min(getattr(rollup, f'{field}_min')),
+                    func.max(getattr(rollup, f'{field}_max')),
+                    func.sum(getattr(rollup, f'{field}_sum'))]
+    query = filter_rollups(db.session.query(*columns), rollup, resolution, date_from, date_to, device_id)
+    rows = query.group_by(rollup.bucket).order_by(rollup.bucket).all()
+
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, {field: {'min': empty, 'max': empty, 'sum': empty} for field in fields}
+
+    columns = list(zip(*rows))
+    aggregates = {}
+    for i, field in enumerate(fields):
+        aggregates[field] = {
+            'min': np.array(columns[2 + 3 * i], dtype=np.int64),
+            'max': np.array(columns[3 + 3 * i], dtype=np.int64),
+            'sum': np.array(columns[4 + 3 * i], dtype=np.int64)
+        }
+    return to_epoch(columns[0]), np.array(columns[1], dtype=np.int64), aggregates
+
+
+def rollup_span(model, date_from=None, date_to=None, device_id=None):
+    """Первый и последний интервал с данными за период, по самому подробному уровню, который ещё хранится"""
+    rollup = ROLLUP_MODELS[model.__name__]
+    for resolution in RESOLUTIONS:
+        query = db.session.query(func.min(rollup.bucket), func.max(rollup.bucket))
+        first, last = filter_rollups(query, rollup, resolution, date_from, date_to, device_id).one()
+        if first is not None:
+            return to_epoch([first])[0], to_epoch([last])[0] + resolution
+    return None
+
+
+def load_history(model, date_from=None, date_to=None, device_id=None, width=None, max_points=500):
+    """
+    min/max/avg по интервалам ширины width (или подобранной под max_points) из rollup таблиц
+    :return: Tuple(начала интервалов, количество точек, Dict[поле, Dict['min'|'max'|'sum'|'avg', np.ndarray]])
+    """
+    if width is None:
+        span = rollup_span(model, date_from, date_to, device_id)
+        width = pick_bucket(int(span[1] - span[0]), max_points) if span is not None else RESOLUTIONS[0]
+
+    resolution = max(resolution for resolution in RESOLUTIONS if width % resolution == 0)
+    return rebucket(*load_rollups(model, resolution, date_from, date_to, device_id), width)
+
+
+def retention_cutoff(days):
+    return datetime.now() - timedelta(days=days)
+
+
+def apply_retention():
+    """
+    Заархивировать завершённые сутки (если задан SENSOR_ARCHIVE_DIR), удалить сырые показания
+    старше RAW_RETENTION_DAYS (кроме привязанных к случаям) и агрегаты уровней старше их срока хранения.
+    Суточные агрегаты хранятся всегда
+    """
+    from api.archive import get_archive, archive_readings, archive_horizon
+    from api.config import RAW_RETENTION_DAYS, MINUTE_ROLLUP_RETENTION_DAYS, HOUR_ROLLUP_RETENTION_DAYS
+
+    if get_archive() is not None:
+        archive_readings()
+
+    if RAW_RETENTION_DAYS is not None:
+        cutoff = retention_cutoff(RAW_RETENTION_DAYS)
+        if get_archive() is not None:
+            # незаархивированные сутки не удаляются
+            cutoff = min(cutoff, datetime.combine(archive_horizon(), datetime.min.time()))
+        for model in (MQ2Data, DHTData):
+            query = model.query.filter(model.date_time < cutoff, model.case_id.is_(None))
+            if get_archive() is not None:
+                # строки, дописанные задним числом после архивации, ждут следующей архивации
+                query = query.filter(model.id <= get_archive().max_id(model))
+            query.delete(synchronize_session=False)
+
+    for resolution, days in ((60, MINUTE_ROLLUP_RETENTION_DAYS), (3600, HOUR_ROLLUP_RETENTION_DAYS)):
+        if days is not None:
+            cutoff = retention_cutoff(days)
+            for rollup in ROLLUP_MODELS.values():
+                rollup.query.filter(rollup.resolution == resolution, rollup.bucket < cutoff) \
+                    .delete(synchronize_session=False)
+    db.session.commit()
+
+
+def retention_worker(interval):
+    while True:
+        with app.app_context():
+            try:
+                apply_retention()
+            except Exception as e:
+                print(e)
+        time.sleep(interval)
+
+
+retention_thread = None
+
+
+@app.before_first_request
+def start_retention_worker():
+    from api.config import RETENTION_INTERVAL, RAW_RETENTION_DAYS, MINUTE_ROLLUP_RETENTION_DAYS, \
+        HOUR_ROLLUP_RETENTION_DAYS, SENSOR_ARCHIVE_DIR
+
+    configured = any(days is not None for days in (RAW_RETENTION_DAYS, MINUTE_ROLLUP_RETENTION_DAYS,
+                                                   HOUR_ROLLUP_RETENTION_DAYS)) or bool(SENSOR_ARCHIVE_DIR)
+    global retention_thread
+    if retention_thread is None and RETENTION_INTERVAL and configured:
+        retention_thread = Thread(target=retention_worker, args=(RETENTION_INTERVAL,), daemon=True)
+        retention_thread.start()
+
+
+def rebuild_start(first, archived_days):
+    """
+    Первые сутки, начиная с которых сырые показания сохранились целиком: заархивированные сутки,
+    а без архива - сутки после срока RAW_RETENTION_DAYS, раньше политика хранения оставляет только показания случаев
+    """
+    from api.config import RAW_RETENTION_DAYS
+
+    starts = [archived_days[0]] if archived_days else []
+    if first is not None:
+        start = first.date()
+        if RAW_RETENTION_DAYS is not None and not archived_days:
+            start = max(start, retention_cutoff(RAW_RETENTION_DAYS).date() + timedelta(days=1))
+        starts.append(start)
+    return min(starts) if starts else None
+
+
+def rebuild_rollups(model):
+    """
+    Пересчитать агрегаты по сырым показаниям, по суткам: показания читаются сразу в массивы из архива
+    (SENSOR_ARCHIVE_DIR) и из базы. Агрегаты суток, сырые показания которых уже удалены политикой хранения,
+    не удаляются и не пересчитываются
+    """
+    from api.archive import get_archive, NO_ID
+
+    fields = SENSOR_FIELDS[model.__name__]
+    rollup = ROLLUP_MODELS[model.__name__]
+    archive = get_archive()
+    archived_days = archive.days(model) if archive is not None else []
+    first, last = db.session.query(func.min(model.date_time), func.max(model.date_time)).one()
+    start = rebuild_start(first, archived_days)
+    if start is None:
+        return
+    end = max(([last.date()] if last is not None else []) + archived_days[-1:])
+
+    day = datetime.combine(start, datetime.min.time())
+    rollup.query.filter(rollup.bucket >= day).delete(synchronize_session=False)
+
+    dtypes = [('date_time', np.int64), ('device_id', np.int32)] + \
+             [(field, COLUMN_DTYPES[model.__name__][field]) for field in fields]
+    columns = [epoch_seconds(model.date_time), func.coalesce(model.device_id, 0)] + \
+              [getattr(model, field) for field in fields]
+    archived_days = set(archived_days)
+    while day.date() <= end:
+        query = filter_series(db.session.query(*columns), model, day, day + timedelta(days=1))
+        if day.date() in archived_days:
+            # в базе остались только строки, дописанные после архивации
+            query = query.filter(model.id > archive.max_id(model))
+        data = fetch_columns(query.order_by(model.date_time, model.id), dtypes)
+        if day.date() in archived_days:
+            stored = archive.load(model, day.date())
+            stored['device_id'] = np.where(stored['device_id'] == NO_ID, 0, stored['device_id'])
+            data = {name: np.concatenate([stored[name], data[name]]) for name, _ in dtypes}
+            order = np.argsort(data['date_time'], kind='stable')
+            data = {name: column[order] for name, column in data.items()}
+
+        params = []
+        for device_id in np.unique(data['device_id']):
+            mask = data['device_id'] == device_id
+            params += rollup_params(model, int(device_id), data['date_time'][mask],
+                                    {field: data[field][mask] for field in fields})
+        if params:
+            db.session.execute(upsert_statement(model), params)
+        day += timedelta(days=1)
+    db.session.commit()
+
+
+@app.cli.group()
+def rollups():
+    """Rollup таблицы показаний датчиков"""
+
+
+@rollups.command('rebuild')
+def rebuild_command():
+    """Пересчитать rollup таблицы по сырым показаниям из базы и архива"""
+    for model in (MQ2Data, DHTData):
+        rebuild_rollups(model)
+        click.echo(f'{model.__name__}: rollups rebuilt')
+
+
+@rollups.command('archive')
+def archive_command():
+    """Заархивировать сырые показания завершённых суток в SENSOR_ARCHIVE_DIR"""
+    from api.archive import archive_readings
+
+    for name, days in archive_readings().items():
+        click.echo(f'{name}: {len(days)} days archived, {sum(rows for _, rows in days)} readings')
+
+
+@rollups.command('prune')
+def prune_command():
+    """Применить политику хранения сырых показаний и агрегатов"""
+    apply_retention()
+    click.echo('Retention applied')
@@ -0,0 +1,84 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# номер кадра в заголовке слота, пока кадр в него пишется
+WRITING = -1
+
+
+class SharedFrameWriter:
+    """
+    Кадры процесса камеры в кольце слотов общей памяти: через очередь передаётся только описание кадра
+    (имя блока, слот, номер, форма), а не сериализованный кадр. В заголовке каждого слота - номер
+    записанного в него кадра, по нему читатель узнаёт, что слот успели перезаписать.
+    Блок создаётся по первому кадру и пересоздаётся, если кадр в слот не помещается
+    """
+
+    def __init__(self, slots=4):
+        self.slots = slots
+        self.shm = None
+        self.header = None
+        self.slot_size = 0
+        self.seq = 0
+
+    def allocate(self, nbytes):
+        self.close()
+        self.slot_size = nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=self.header_size() + self.slots * nbytes)
+        self.header = np.ndarray((self.slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.header[:] = WRITING
+
+    def header_size(self):
+        return self.slots * np.dtype(np.int64).itemsize
+
+    def write(self, frame):
+        """:return: Tuple(имя блока, слот, смещение, номер кадра, форма, dtype) для SharedFrameReader.read"""
+        if self.shm is None or frame.nbytes > self.slot_size:
+            self.allocate(frame.nbytes)
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = self.header_size() + slot * self.slot_size
+        self.header[slot] = WRITING
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf, offset=offset)[...] = frame
+        self.header[slot] = self.seq
+        return self.shm.name, slot, offset, self.seq, frame.shape, frame.dtype.str
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.header = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class SharedFrameReader:
+    """Копирует кадры из блоков SharedFrameWriter другого процесса"""
+
+    def __init__(self):
+        self.shm = None
+
+    def slot_seq(self, slot):
+        return np.frombuffer(self.shm.buf, dtype=np.int64, count=1, offset=slot * np.dtype(np.int64).itemsize)[0]
+
+    def read(self, descriptor):
+        """:return: копия кадра или None, если слот уже перезаписан или блок удалён"""
+        name, slot, offset, seq, shape, dtype = descriptor
+        if self.shm is None or self.shm.name != name:
+            self.close()
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                return None
+        if self.slot_seq(slot) != seq:
+            return None
+        frame = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset).copy()
+        if self.slot_seq(slot) != seq:
+            return None
+        return frame
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.shm.close()
+        self.shm = None
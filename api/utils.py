@@ -3,37 +3,35 @@ import enum
 import io
 import json
 import os
-from datetime import datetime
+import zlib
+from bisect import bisect_right
+from datetime import datetime, timedelta
 from types import GeneratorType
 
 import pdfkit
 import pyqrcode as pyqr
 import plotly.graph_objects as go
-from flask import render_template, make_response
+from flask import render_template, make_response, request, stream_with_context, Response
 from flask_mail import Message
 from plotly import io
-from pywebpush import webpush, WebPushException
+
+from api.levels import get_thresholds
+
+
+REPORT_MAX_POINTS = 500
 
 
 def know_level(value, low, moderate, danger, emergency):
-    if value in range(low, moderate):
-        return 1
-    elif value in range(moderate + 1, danger):
-        return 2
-    elif value in range(danger + 1, emergency):
-        return 3
-    elif value > emergency:
-        return 4
-    else:
-        return 0
+    return bisect_right((low, moderate, danger, emergency), value)
+
 
+def check_gas_level(lpg_value, co_value, smoke_value, device_id=None):
+    return get_thresholds().check(lpg_value, co_value, smoke_value, device_id)
 
-def check_gas_level(lpg_value, co_value, smoke_value):
-    lpg_level = know_level(value=lpg_value, low=5500, moderate=6900, danger=10000, emergency=18000)
-    co_level = know_level(value=co_value, low=10, moderate=24, danger=50, emergency=400)
-    smoke_level = know_level(value=smoke_value, low=10, moderate=24, danger=50, emergency=400)
-    general_level = max(lpg_level, co_level, smoke_level)
-    return general_level
+
+def check_gas_levels(lpg_values, co_values, smoke_values, device_ids=None):
+    """Векторная версия check_gas_level для пачек показаний (bulk ingest, пересчёт истории)"""
+    return get_thresholds().check_batch(lpg_values, co_values, smoke_values, device_ids)
 
 
 class LevelType(enum.Enum):
@@ -46,17 +44,69 @@ class LevelType(enum.Enum):
         return self.name
 
 
+class JobStatus(enum.Enum):
+    queued = 1
+    running = 2
+    done = 3
+    failed = 4
+
+    def __str__(self):
+        return self.name
+
+
 class Encoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.__str__()
-        if isinstance(obj, LevelType):
+        if isinstance(obj, (LevelType, JobStatus)):
             return obj.__str__()
         if isinstance(obj, GeneratorType):
             return str(obj.__next__())
         return json.JSONEncoder.default(self, obj)
 
 
+def encode_cursor(row):
+    return f"{row['date_time'].isoformat()}_{row['id']}"
+
+
+def decode_cursor(cursor):
+    date_time, row_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(date_time), int(row_id)
+
+
+def iter_json_list(rows, chunk_size=500):
+    chunk = ['[']
+    for i, row in enumerate(rows):
+        if i:
+            chunk.append(',')
+        chunk.append(json.dumps(row, cls=Encoder))
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def json_stream_response(rows, status=200):
+    """Отдать список потоком, не собирая весь JSON в памяти; сжимаем сами, т.к. Flask-Compress буферизует ответ"""
+    chunks = iter_json_list(rows)
+    if 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+        response = Response(stream_with_context(gzip_stream(chunks)), status, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    return Response(stream_with_context(chunks), status, mimetype='application/json')
+
+
 def create_plot(**data):
     fig = go.Figure()
 
@@ -103,9 +153,124 @@ def pdf_response(template, context):
     return response
 
 
+def report_series(model, case_id):
+    """
+    Показания случая для графика. Длинные случаи прореживаются до REPORT_MAX_POINTS средних по интервалам.
+    Средние берутся из rollup таблиц устройства случая, если в окне случая у этого устройства нет других показаний;
+    иначе (несколько устройств, чужие показания в окне, rollup ещё не построены) - считаются по показаниям случая
+    """
+    from sqlalchemy import func
+    from api.models import db
+    from api.downsampling import load_series, pick_bucket, downsample, to_epoch, from_epoch
+    from api.rollups import RESOLUTIONS, load_history
+
+    first, last, count, devices = db.session.query(func.min(model.date_time), func.max(model.date_time),
+                                                   func.count(model.id), func.count(model.device_id.distinct())) \
+        .filter(model.case_id == case_id).one()
+    if count > REPORT_MAX_POINTS:
+        span = int(to_epoch([last])[0] - to_epoch([first])[0]) + 1
+        width = pick_bucket(span, REPORT_MAX_POINTS)
+        timestamps = []
+        device_id = db.session.query(model.device_id).filter(model.case_id == case_id).limit(1).scalar() \
+            if devices == 1 else None
+        if device_id is not None:
+            # окно по границам интервалов rollup: крайние интервалы не должны захватывать чужие показания
+            resolution = max(resolution for resolution in RESOLUTIONS if width % resolution == 0)
+            window_start, window_end = from_epoch(to_epoch([first, last]) // resolution * resolution +
+                                                  [0, resolution])
+            in_window = db.session.query(func.count(model.id)) \
+                .filter(model.device_id == device_id, model.date_time >= window_start,
+                        model.date_time < window_end).scalar()
+            if in_window == count:
+                timestamps, _, aggregates = load_history(model, date_from=first, date_to=last + timedelta(seconds=1),
+                                                         device_id=device_id, width=width)
+        if len(timestamps) == 0:
+            timestamps, _, aggregates = downsample(*load_series(model, case_id=case_id), width)
+        values = {field: aggregate['avg'] for field, aggregate in aggregates.items()}
+    else:
+        timestamps, values = load_series(model, case_id=case_id)
+    return from_epoch(timestamps), {field: column.tolist() for field, column in values.items()}
+
+
+def case_device_location(case_id):
+    from api.models import db, Device, MQ2Data
+
+    return db.session.query(Device.location).join(MQ2Data, MQ2Data.device_id == Device.id) \
+        .filter(MQ2Data.case_id == case_id).order_by(MQ2Data.id).limit(1).scalar()
+
+
+def case_readings_fingerprint(model, case_id):
+    """Дешёвая сводка показаний случая: меняется, когда к случаю добавляются показания"""
+    from sqlalchemy import func
+    from api.models import db
+    from api.downsampling import SENSOR_FIELDS
+
+    columns = [func.count(model.id), func.max(model.id), func.max(model.date_time)]
+    columns += [func.sum(getattr(model, field)) for field in SENSOR_FIELDS[model.__name__]]
+    return list(db.session.query(*columns).filter(model.case_id == case_id).one())
+
+
+template_versions = {}
+
+
+def template_version(template):
+    if template not in template_versions:
+        from api.config import PROJECT_DIR
+        from api.report_cache import digest
+
+        with open(os.path.join(PROJECT_DIR, 'templates', template), 'rb') as f:
+            template_versions[template] = digest(f.read().decode('utf8'))
+    return template_versions[template]
+
+
+def report_fingerprint(report):
+    """Хэш всех данных, от которых зависит отчёт"""
+    from api.config import CLIENT_APP_BASE_URL
+    from api.models import MQ2Data, DHTData
+    from api.report_cache import digest
+
+    parts = [report.id, report.created_at, report.content, CLIENT_APP_BASE_URL]
+    if report.case is not None:
+        case = report.case
+        parts += [case.id, case.date_time, str(case.level), case.note, case_device_location(case.id),
+                  case_readings_fingerprint(MQ2Data, case.id), case_readings_fingerprint(DHTData, case.id)]
+    if report.log is not None:
+        log = report.log
+        parts += [log.id, log.date_time, log.recognized_objects, log.camera_id, log.camera.location]
+    return digest(*parts)
+
+
+def gas_plot(case_id):
+    from api.models import MQ2Data
+
+    gas_dates, gas_values = report_series(MQ2Data, case_id)
+    gas_data = {
+        "x": gas_dates,
+        "y": [gas_values['lpg'], gas_values['co'], gas_values['smoke']],
+        "legends": ["LPG, ppm", "CO, ppm", "Smoke, ppm"]
+    }
+    return create_plot(**gas_data)
+
+
+def temphud_plot(case_id):
+    from api.models import DHTData
+
+    temphud_dates, temphud_values = report_series(DHTData, case_id)
+    temphud_data = {
+        "x": temphud_dates,
+        "y": [temphud_values['temp'], temphud_values['hudimity']],
+        "legends": ["Temperature, C", "Hudimity, %"]
+    }
+    return create_plot(**temphud_data)
+
+
 def get_report_context(report_id):
-    from api.models import Report
+    """Контекст шаблона отчёта; графики и QR код берутся из кэша артефактов, пока данные не изменились"""
+    from api.config import CLIENT_APP_BASE_URL
+    from api.models import Report, MQ2Data, DHTData
+    from api.report_cache import get_report_cache, digest
 
+    cache = get_report_cache()
     report = Report.query.get(report_id)
     context = {
         "created_at": report.created_at,
@@ -116,35 +281,14 @@ def get_report_context(report_id):
         context['case_datetime'] = case.date_time
         context['case_level'] = case.level
         context['case_note'] = case.note
-        context['device_location'] = case.mq2_data[0].device.location
-        mq2_data_list = [el.as_dict() for el in case.mq2_data]
-        dht_data_list = [el.as_dict() for el in case.dht_data]
-
-        gas_dates = [el['date_time'] for el in mq2_data_list]
-        lpg = [el['lpg'] for el in mq2_data_list]
-        co = [el['co'] for el in mq2_data_list]
-        smoke = [el['smoke'] for el in mq2_data_list]
-
-        temphud_dates = [el['date_time'] for el in dht_data_list]
-        temp = [el['temp'] for el in dht_data_list]
-        hud = [el['hudimity'] for el in dht_data_list]
-
-        gas_data = {
-            "x": gas_dates,
-            "y": [lpg, co, smoke],
-            "legends": ["LPG, ppm", "CO, ppm", "Smoke, ppm"]
-        }
-
-        temphud_data = {
-            "x": temphud_dates,
-            "y": [temp, hud],
-            "legends": ["Temperature, C", "Hudimity, %"]
-        }
-
-        gas_plot = create_plot(**gas_data)
-        temphud_plot = create_plot(**temphud_data)
-        context['gas_base64'] = convert_to_base64(gas_plot)
-        context['temphud_base64'] = convert_to_base64(temphud_plot)
+        context['device_location'] = case_device_location(case.id)
+
+        gas_key = digest('gas', REPORT_MAX_POINTS, case_readings_fingerprint(MQ2Data, case.id))
+        temphud_key = digest('temphud', REPORT_MAX_POINTS, case_readings_fingerprint(DHTData, case.id))
+        gas_svg = cache.get_or_create(gas_key, 'svg', lambda: io.to_image(gas_plot(case.id), format='svg'))
+        temphud_svg = cache.get_or_create(temphud_key, 'svg', lambda: io.to_image(temphud_plot(case.id), format='svg'))
+        context['gas_base64'] = base64.b64encode(gas_svg).decode('ascii')
+        context['temphud_base64'] = base64.b64encode(temphud_svg).decode('ascii')
 
     if report.log is not None:
         log = report.log
@@ -153,13 +297,35 @@ def get_report_context(report_id):
         context['camera_id'] = log.camera.id
         context['camera_location'] = log.camera.location
 
-    from api.config import CLIENT_APP_BASE_URL
-    qr = pyqr.create(f"{CLIENT_APP_BASE_URL}/reports/{report.id}")
-    context['qr_code'] = qr.png_as_base64_str(scale=3)
+    qr_url = f"{CLIENT_APP_BASE_URL}/reports/{report.id}"
+    qr_png = cache.get_or_create(digest('qr', qr_url), 'png',
+                                 lambda: base64.b64decode(pyqr.create(qr_url).png_as_base64_str(scale=3)))
+    context['qr_code'] = base64.b64encode(qr_png).decode('ascii')
 
     return context
 
 
+def report_pdf_key(report_id):
+    """Ключ PDF отчёта в кэше: меняется, если изменились отчёт, его данные или шаблон"""
+    from api.models import Report
+    from api.report_cache import digest
+
+    report = Report.query.get(report_id)
+    return digest('pdf', template_version("report.html"), report_fingerprint(report))
+
+
+def open_report_pdf(report_id, build=True):
+    """
+    Открытый PDF отчёта из кэша; PDF генерируется только если отчёт или его данные изменились.
+    build=False - только из кэша, None, если PDF ещё не сгенерирован
+    """
+    from api.report_cache import get_report_cache
+
+    return get_report_cache().open(report_pdf_key(report_id), 'pdf',
+                                   (lambda: generate_pdf("report.html", get_report_context(report_id)))
+                                   if build else None)
+
+
 def send_mail_with_attachment(report_id, recipient_mail):
     from api.flask_app import mail
     subject = "GasDnW"
@@ -167,8 +333,8 @@ def send_mail_with_attachment(report_id, recipient_mail):
 
     msg = Message(subject=subject, body=body, recipients=[recipient_mail])
 
-    context = get_report_context(report_id)
-    pdf = generate_pdf("report.html", context)
+    with open_report_pdf(report_id) as f:
+        pdf = f.read()
 
     msg.attach(filename="gasdnw report.pdf", content_type="application/pdf", data=pdf)
 
@@ -176,50 +342,23 @@ def send_mail_with_attachment(report_id, recipient_mail):
 
 
 def send_web_push(subscription_information, message_body):
-    from api.config import VAPID_PRIVATE_KEY, VAPID_CLAIMS
-    return webpush(
-        subscription_info=subscription_information,
-        data=message_body,
-        vapid_private_key=VAPID_PRIVATE_KEY,
-        vapid_claims=VAPID_CLAIMS
-    )
+    from api.push import get_dispatcher
+    return get_dispatcher().send(subscription_information, message_body)
 
 
 def notify_about_warning(message):
+    """Поставить рассылку уведомления всем подписчикам в очередь, не дожидаясь отправки"""
     from api.models import Subscriber
-    subscribers = Subscriber.query.all()
-
-    for subscriber in subscribers:
-        try:
-            token = {
-                'endpoint': subscriber.endpoint,
-                'expirationTime': subscriber.expiration_time,
-                'keys': {
-                    'p256dh': subscriber.p256dh,
-                    'auth': subscriber.auth
-                }
+    from api.push import get_dispatcher
+
+    subscriptions = [
+        {
+            'endpoint': subscriber.endpoint,
+            'expirationTime': subscriber.expiration_time,
+            'keys': {
+                'p256dh': subscriber.p256dh,
+                'auth': subscriber.auth
             }
-            send_web_push(token, message)
-        except WebPushException as e:
-            print(e)
-            continue
-
-
-def get_chunk(filename, byte1=None, byte2=None):
-    from api.config import PROJECT_DIR
-    filepath = os.path.join(PROJECT_DIR, filename)
-    file_size = os.stat(filepath).st_size
-    start = 0
-    length = 102400
-
-    if byte1 < file_size:
-        start = byte1
-    if byte2:
-        length = byte2 + 1 - byte1
-    else:
-        length = file_size - start
-
-    with open(filepath, 'rb') as f:
-        f.seek(start)
-        chunk = f.read(length)
-    return chunk, start, length, file_size
+        } for subscriber in Subscriber.query.all()
+    ]
+    return get_dispatcher().submit(subscriptions, message)
@@ -0,0 +1,172 @@
+import mmap
+import os
+import time
+import uuid
+import zlib
+from datetime import datetime
+from threading import Lock
+
+from flask import request, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StatCache:
+    """os.stat файлов клипов на ttl секунд: клиенты, перематывающие видео, шлют много Range запросов подряд"""
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = {}
+
+    def get(self, path):
+        """:return: os.stat_result или None, если файла нет"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and now - entry[0] < self.ttl:
+                return entry[1]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        with self.lock:
+            if len(self.entries) > 1024:
+                self.entries.clear()
+            self.entries[path] = (now, stat)
+        return stat
+
+
+def parse_range_header(value):
+    """
+    Range заголовок bytes=... в список (begin, end): end не включительно или None, суффикс bytes=-N - (-N, None).
+    В отличие от werkzeug пересекающиеся диапазоны разрешены, их объединяет resolve_ranges
+    :return: List[Tuple(begin, end)] или None, если заголовка нет или его не разобрать
+    """
+    if not value or not value.startswith('bytes='):
+        return None
+    ranges = []
+    for item in value[len('bytes='):].split(','):
+        begin, sep, end = item.strip().partition('-')
+        begin, end = begin.strip(), end.strip()
+        if not sep or not (begin.isdigit() or (not begin and end.isdigit())) or (end and not end.isdigit()):
+            return None
+        if not begin:
+            ranges.append((-int(end), None))
+        elif not end:
+            ranges.append((int(begin), None))
+        elif int(end) < int(begin):
+            return None
+        else:
+            ranges.append((int(begin), int(end) + 1))
+    return ranges
+
+
+def resolve_ranges(ranges, size):
+    """
+    Диапазоны Range заголовка в байтах файла: суффиксы (bytes=-N), открытые (bytes=N-),
+    пересекающиеся и соседние диапазоны объединяются
+    :param ranges: List[Tuple(begin, end)] из parse_range_header
+    :return: List[Tuple(start, stop)], stop не включительно; пустой список - диапазон не удовлетворим
+    """
+    resolved = []
+    for begin, end in ranges:
+        if begin < 0:
+            start, stop = max(0, size + begin), size
+        else:
+            start, stop = begin, size if end is None else min(end, size)
+        if start < stop:
+            resolved.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(resolved):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def part_header(boundary, mimetype, start, stop, size):
+    return (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('latin-1')
+
+
+def iter_byteranges(path, ranges, boundary, mimetype, size):
+    """multipart/byteranges по кускам CHUNK_SIZE из отображённого в память файла, без чтения диапазонов целиком"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, stop in ranges:
+            yield part_header(boundary, mimetype, start, stop, size)
+            for offset in range(start, stop, CHUNK_SIZE):
+                yield data[offset:min(offset + CHUNK_SIZE, stop)]
+            yield b'\r\n'
+        yield f"--{boundary}--\r\n".encode('latin-1')
+
+
+def byteranges_length(ranges, boundary, mimetype, size):
+    length = len(f"--{boundary}--\r\n")
+    for start, stop in ranges:
+        length += len(part_header(boundary, mimetype, start, stop, size)) + stop - start + 2
+    return length
+
+
+def if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if not if_range.etag and not if_range.date:
+        return True
+    if if_range.etag:
+        return if_range.etag == etag
+    return if_range.date >= last_modified.replace(microsecond=0)
+
+
+def file_response(path, stat, mimetype):
+    """
+    Отдать файл с поддержкой условных запросов (ETag, Last-Modified) и Range. Файл целиком (200) отдаётся
+    через wsgi.file_wrapper, и сервер может использовать sendfile. Одиночный и суффиксный диапазон (206)
+    werkzeug читает из файла кусками по CHUNK_SIZE в Python, несколько диапазонов - multipart/byteranges
+    кусками из mmap; в память целиком не читается ни один диапазон
+    """
+    size = stat.st_size
+    etag = f"{int(stat.st_mtime)}-{size}-{zlib.adler32(path.encode('utf-8'))}"
+    last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+
+    ranges = parse_range_header(request.headers.get('Range'))
+    if ranges is None:
+        # нераспознанный Range игнорируется и файл отдаётся целиком (RFC 7233, 3.1),
+        # 416 - только для разобранных, но неудовлетворимых диапазонов
+        request.environ.pop('HTTP_RANGE', None)
+    elif len(ranges) > 1 and if_range_matches(etag, last_modified) and request.method == 'GET':
+        ranges = resolve_ranges(ranges, size)
+        if not ranges:
+            return range_not_satisfiable(size)
+        if len(ranges) > 1:
+            boundary = uuid.uuid4().hex
+            response = Response(iter_byteranges(path, ranges, boundary, mimetype, size), 206,
+                                mimetype=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+            response.content_length = byteranges_length(ranges, boundary, mimetype, size)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.accept_ranges = 'bytes'
+            return response.make_conditional(request)
+        # после объединения остался один диапазон - дальше как обычный Range
+        start, stop = ranges[0]
+        request.environ['HTTP_RANGE'] = f"bytes={start}-{stop - 1}"
+
+    response = Response(wrap_file(request.environ, open(path, 'rb'), CHUNK_SIZE), mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = size
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        return range_not_satisfiable(size)
+
+
+def range_not_satisfiable(size):
+    response = Response(status=416)
+    response.headers['Content-Range'] = f"bytes */{size}"
+    return response
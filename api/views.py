@@ -1,16 +1,33 @@
 import json
-import re
+import os
+from datetime import datetime
+from itertools import chain
 
-from flask import request, Response
+from flask import request, Response, send_file
 from flask_restful import Resource
-
-from api.config import CLIENT_APP_BASE_URL
-from api.cv import gen_video
-from api.models import db, Device, MQ2Data, DHTData, Case, Log, Report, Subscriber, Notification, Camera
-from api.utils import check_gas_level, LevelType, get_report_context, \
-    pdf_response, send_mail_with_attachment, notify_about_warning, get_chunk
-from .flask_app import api
-
+from sqlalchemy import and_, or_
+from werkzeug.security import safe_join
+
+from api.cache import mq2_cache, dht_cache
+from api.clips import index_clip, load_clip_index, thumb_path
+from api.config import CLIENT_APP_BASE_URL, JOBS_DIR, CAMERA_ID, LOCATION, CAMERAS_AUTOSTART, PROJECT_DIR
+from api.downsampling import BUCKETS, to_records
+from api.ingest import ingest_mq2_readings, ingest_dht_readings
+from api.jobs import get_job_queue, validate_job
+from api.metrics import exposition
+from api.models import db, Device, MQ2Data, DHTData, Case, Log, Report, Subscriber, Notification, Camera, Job
+from api.rollups import load_history
+from api.video import StatCache, file_response
+from api.utils import open_report_pdf, notify_about_warning, JobStatus, \
+    encode_cursor, decode_cursor, json_stream_response
+from .flask_app import api, app
+
+
+MAX_PAGE_SIZE = 10000
+STREAM_BATCH_SIZE = 1000
+HISTORY_MAX_POINTS = 500
+
+clip_stat_cache = StatCache()
 
 # Views
 
@@ -18,13 +35,14 @@ from .flask_app import api
 class MQ2API(Resource):
     def get(self):
         """
-        Получить последнюю запись в таблице
+        Получить последнюю запись в таблице (по всем устройствам или по ?device_id=)
         :return: Tuple(JSON Object, HTTP Status Code)
         """
         try:
-            if db.session.query(MQ2Data.id).count() > 0:
-                obj = MQ2Data.query.order_by(-MQ2Data.id).first()
-                return obj.as_dict(), 200
+            device_id = request.args.get('device_id', type=int)
+            row = mq2_cache.get() if device_id is None else mq2_cache.get(device_id)
+            if row is not None:
+                return row, 200
 
             return "No content", 204
         except Exception as e:
@@ -38,76 +56,39 @@ class MQ2API(Resource):
         """
         try:
             sensor_data = request.get_json()
-            lpg_value = sensor_data.get('LPG')
-            co_value = sensor_data.get('CO')
-            smoke_value = sensor_data.get('Smoke')
-            device_id = sensor_data.get('device_id')
-
-            # последние данные с датчиков
-            last_mq2data = MQ2Data.query.order_by(MQ2Data.date_time.desc()).first()
-            last_dhtdata = DHTData.query.order_by(DHTData.date_time.desc()).first()
-
-            device = Device.query.get(device_id)
-
-            # проверяем на уровень опасности
-            level = check_gas_level(lpg_value, co_value, smoke_value)
-
-            if level != 0:
-                mq2data = MQ2Data(lpg=lpg_value, co=co_value, smoke=smoke_value, device_id=device_id)
-                db.session.add(mq2data)
-                db.session.commit()
-
-                # разница во времени между последней и текущей зафиксированной инф-и о детекции газа
-                time_diff = mq2data.date_time - last_mq2data.date_time
-                note = f"Warning! Gas detected! " \
-                       f"Location: {device.location}. " \
-                       f"Gas concentration - LPG: {lpg_value} ppm - CO: {co_value} ppm - Smoke: {smoke_value} ppm."
-
-                # если разница больше чем 30
-                if time_diff.seconds > 30:
-                    # создаем новый случай
-                    case = Case()
-                    case.note = note
-                    case.level = LevelType(level)
-                    case.dht_data.append(last_dhtdata)
-                    case.mq2_data.append(mq2data)
-
-                    db.session.flush()
-                    case_id = case.id
-                    notification = Notification(content=note, case_id=case_id)
-                    db.session.add_all([case, notification])
-
-                    # делаем рассылку уведомлений
-                    message = json.dumps({
-                        "type": "case",
-                        "link": f"{CLIENT_APP_BASE_URL}/logs/cases/{case_id}",
-                        "message": note
-                    })
-
-                    notify_about_warning(message)
-                else:
-                    # в противном случае связываем информацию с датчиков в последний случай
-                    last_case = Case.query.order_by(Case.date_time.desc()).first()
-                    last_case.dht_data.append(last_dhtdata)
-                    last_case.mq2_data.append(mq2data)
-                db.session.commit()
-
+            ingest_mq2_readings([sensor_data])
             return 200
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
 
 
+class MQ2BatchAPI(Resource):
+    def post(self):
+        """
+        Принять пакет показаний с нескольких датчиков и записать их одной транзакцией
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
+        try:
+            readings = request.get_json()
+            inserted, case_ids = ingest_mq2_readings(readings)
+            return {"inserted": inserted, "cases": case_ids}, 200
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
+
+
 class DHTAPI(Resource):
     def get(self):
         """
-        Получить последнюю запись в таблице
+        Получить последнюю запись в таблице (по всем устройствам или по ?device_id=)
         :return: Tuple(JSON Object, HTTP Status Code)
         """
         try:
-            if db.session.query(DHTData.id).count():
-                obj = DHTData.query.order_by(-DHTData.id).first()
-                return obj.as_dict(), 200
+            device_id = request.args.get('device_id', type=int)
+            row = dht_cache.get() if device_id is None else dht_cache.get(device_id)
+            if row is not None:
+                return row, 200
 
             return "No content", 204
         except Exception as e:
@@ -121,50 +102,141 @@ class DHTAPI(Resource):
         """
         try:
             sensor_data = request.get_json()
-            temp = sensor_data.get('Temperature')
-            hudimity = sensor_data.get('Hudimity')
-            device_id = sensor_data.get('device_id')
+            ingest_dht_readings([sensor_data])
+            return 200
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
 
-            dhtdata = DHTData(temp=temp, hudimity=hudimity, device_id=device_id)
-            db.session.add(dhtdata)
-            db.session.commit()
 
-            return 200
+class DHTBatchAPI(Resource):
+    def post(self):
+        """
+        Принять пакет показаний с нескольких датчиков и записать их одной транзакцией
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
+        try:
+            readings = request.get_json()
+            inserted = ingest_dht_readings(readings)
+            return {"inserted": inserted}, 200
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
 
 
-class MQ2ListAPI(Resource):
+class SensorListAPI(Resource):
+    model = None
+
     def get(self):
+        """
+        Получить записи таблицы по возрастанию (date_time, id).
+        Параметры: from, to (ISO 8601, полуинтервал [from, to)), device_id, limit, cursor.
+        С limit возвращается страница и заголовок X-Next-Cursor, без limit - весь диапазон потоком
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
         try:
-            q = MQ2Data.query.all()
-            if len(q) > 0:
-                resp = [row.as_dict() for row in q]
-                return resp, 200
-            else:
+            model = self.model
+            query = db.session.query(*model.__table__.columns)
+
+            date_from = request.args.get('from')
+            date_to = request.args.get('to')
+            device_id = request.args.get('device_id', type=int)
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', type=int)
+
+            if device_id is not None:
+                query = query.filter(model.device_id == device_id)
+            if date_from:
+                query = query.filter(model.date_time >= datetime.fromisoformat(date_from))
+            if date_to:
+                query = query.filter(model.date_time < datetime.fromisoformat(date_to))
+            if cursor:
+                cursor_date_time, cursor_id = decode_cursor(cursor)
+                query = query.filter(or_(model.date_time > cursor_date_time,
+                                         and_(model.date_time == cursor_date_time, model.id > cursor_id)))
+            query = query.order_by(model.date_time, model.id)
+
+            if limit is None:
+                rows = (row._asdict() for row in query.yield_per(STREAM_BATCH_SIZE))
+                first = next(rows, None)
+                if first is None:
+                    return [], 204
+                return json_stream_response(chain([first], rows))
+
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+            rows = [row._asdict() for row in query.limit(limit + 1)]
+            if not rows:
                 return [], 204
 
+            headers = {}
+            if len(rows) > limit:
+                rows = rows[:limit]
+                headers['X-Next-Cursor'] = encode_cursor(rows[-1])
+            return rows, 200, headers
+
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
 
 
-class DHTListAPI(Resource):
+class MQ2ListAPI(SensorListAPI):
+    model = MQ2Data
+
+
+class DHTListAPI(SensorListAPI):
+    model = DHTData
+
+
+class SensorHistoryAPI(Resource):
+    model = None
+
     def get(self):
+        """
+        Получить min/max/avg показаний по интервалам времени.
+        Параметры: from, to (ISO 8601), device_id, bucket (1m, 5m, 15m, 1h, 6h, 1d) или max_points
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
         try:
-            q = DHTData.query.all()
-            if len(q) > 0:
-                resp = [row.as_dict() for row in q]
-                return resp, 200
-            else:
+            date_from = request.args.get('from')
+            date_to = request.args.get('to')
+            bucket = request.args.get('bucket')
+            max_points = request.args.get('max_points', default=HISTORY_MAX_POINTS, type=int)
+
+            width = None
+            if bucket is not None:
+                if bucket not in BUCKETS:
+                    return "Bad Request", 400
+                width = BUCKETS[bucket]
+
+            records = to_records(*load_history(self.model,
+                                               date_from=datetime.fromisoformat(date_from) if date_from else None,
+                                               date_to=datetime.fromisoformat(date_to) if date_to else None,
+                                               device_id=request.args.get('device_id', type=int),
+                                               width=width,
+                                               max_points=max(max_points, 1)))
+            if not records:
                 return [], 204
+            return records, 200
 
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
 
 
+class MQ2HistoryAPI(SensorHistoryAPI):
+    model = MQ2Data
+
+
+class DHTHistoryAPI(SensorHistoryAPI):
+    model = DHTData
+
+
 class CaseAPI(Resource):
     def get(self, case_id):
         try:
@@ -196,6 +268,11 @@ class LogAPI(Resource):
             res = {
                 "log": log_dict
             }
+            if log.video_filename:
+                # постер и точки перемотки, чтобы не тянуть видео ради превью
+                path = safe_join(PROJECT_DIR, log.video_filename)
+                res['clip'] = load_clip_index(path) if path is not None else None
+                res['thumbnail'] = f"/video/{log.video_filename}/thumb" if res['clip'] is not None else None
 
             return res, 200
         except Exception as e:
@@ -250,19 +327,51 @@ class CaseListAPI(Resource):
             return "Internal Server Error", 500
 
 
+def desc_page(query, date_column, id_column, key):
+    """
+    Страница запроса по убыванию (date_column, id_column): параметры limit, cursor.
+    Без limit - все записи
+    :return: Tuple(List[dict], dict заголовков с X-Next-Cursor)
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+
+    if cursor:
+        cursor_date_time, cursor_id = decode_cursor(cursor)
+        query = query.filter(or_(date_column < cursor_date_time,
+                                 and_(date_column == cursor_date_time, id_column < cursor_id)))
+    query = query.order_by(date_column.desc(), id_column.desc())
+
+    if limit is None:
+        return [row._asdict() for row in query], {}
+
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    rows = [row._asdict() for row in query.limit(limit + 1)]
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor({'date_time': rows[-1][key], 'id': rows[-1]['id']})
+    return rows, headers
+
+
 class LogListAPI(Resource):
     def get(self):
+        """
+        Журнал камер по убыванию времени, одним запросом вместе с местоположением камеры.
+        Параметры: limit, cursor (X-Next-Cursor предыдущей страницы)
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
         try:
-            q = Log.query.order_by(Log.date_time.desc()).all()
-            if len(q) > 0:
-                resp = []
-                for log in q:
-                    obj = log.as_dict()
-                    obj['location'] = log.camera.location
-                    resp.append(obj)
-                return resp, 200
+            query = db.session.query(*Log.__table__.columns, Camera.location.label('location')) \
+                .outerjoin(Camera, Log.camera_id == Camera.id)
+            resp, headers = desc_page(query, Log.date_time, Log.id, 'date_time')
+            if len(resp) > 0:
+                return resp, 200, headers
             else:
                 return [], 204
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
@@ -270,24 +379,45 @@ class LogListAPI(Resource):
 
 class ReportListAPI(Resource):
     def get(self):
+        """
+        Отчёты по убыванию даты создания. Случай, журнал, камера и местоположение устройства
+        берутся в том же запросе, а не отдельными запросами на каждый отчёт.
+        Параметры: limit, cursor (X-Next-Cursor предыдущей страницы)
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
         try:
-            reports = Report.query.order_by(Report.created_at.desc()).all()
-            resp = []
-            for report in reports:
-                obj = report.as_dict()
-
-                if report.case is not None:
-                    case = report.case
-                    obj['case_datetime'] = case.date_time
-                    obj['case_level'] = case.level
-                    obj['device_location'] = case.mq2_data[0].device.location
-                if report.log is not None:
-                    log = report.log
-                    obj['log_datetime'] = log.date_time
-                    obj['camera_location'] = log.camera.location
+            # устройство случая - устройство его первого показания MQ2
+            device_location = db.session.query(Device.location) \
+                .join(MQ2Data, MQ2Data.device_id == Device.id) \
+                .filter(MQ2Data.case_id == Report.case_id) \
+                .order_by(MQ2Data.id).limit(1).correlate(Report).as_scalar()
+
+            query = db.session.query(*Report.__table__.columns,
+                                     Case.date_time.label('case_datetime'),
+                                     Case.level.label('case_level'),
+                                     device_location.label('device_location'),
+                                     Log.date_time.label('log_datetime'),
+                                     Camera.location.label('camera_location')) \
+                .outerjoin(Case, Report.case_id == Case.id) \
+                .outerjoin(Log, Report.log_id == Log.id) \
+                .outerjoin(Camera, Log.camera_id == Camera.id)
+            rows, headers = desc_page(query, Report.created_at, Report.id, 'created_at')
 
+            resp = []
+            for row in rows:
+                obj = {key: row[key] for key in ('id', 'created_at', 'content', 'case_id', 'log_id')}
+                if row['case_id'] is not None:
+                    obj['case_datetime'] = row['case_datetime']
+                    obj['case_level'] = row['case_level']
+                    obj['device_location'] = row['device_location']
+                if row['log_id'] is not None:
+                    obj['log_datetime'] = row['log_datetime']
+                    obj['camera_location'] = row['camera_location']
                 resp.append(obj)
-            return resp, 200
+            return resp, 200, headers
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
@@ -355,8 +485,31 @@ class CreateReportAPI(Resource):
 
 class GenerateReportAPI(Resource):
     def get(self, report_id):
-        context = get_report_context(report_id)
-        return pdf_response("report.html", context=context)
+        """
+        PDF отчёта: готовый PDF из кэша отдаётся сразу, иначе генерация ставится в очередь задач
+        и возвращается 202 со ссылками на задачу и её результат
+        :return: PDF или Tuple(JSON Object, HTTP Status Code, Headers)
+        """
+        try:
+            if Report.query.get(report_id) is None:
+                return "Not found", 404
+            pdf = open_report_pdf(report_id, build=False)
+            if pdf is not None:
+                return send_file(pdf, mimetype="application/pdf", as_attachment=True,
+                                 attachment_filename="gasdnw report.pdf", conditional=True)
+
+            queue = get_job_queue()
+            job = queue.find_active('report', report_id=report_id) or queue.enqueue('report', report_id=report_id)
+            job_url = api.url_for(JobAPI, job_id=job.id)
+            return {
+                "job_id": job.id,
+                "status": job.status,
+                "job_url": job_url,
+                "result_url": api.url_for(JobResultAPI, job_id=job.id)
+            }, 202, {'Location': job_url}
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
 
 
 class SubscriptionAPI(Resource):
@@ -401,33 +554,92 @@ class NotificationAPI(Resource):
 
 
 class CameraAPI(Resource):
-    def get(self):
+    def get(self, camera_id=None):
+        """
+        MJPEG поток камеры. Параметры клиента: quality - качество JPEG (1-100), fps - максимум кадров в секунду,
+        kbps - целевой битрейт, под который подстраивается качество
+        """
         try:
-            return Response(gen_video(),
+            # CV подсистема (cv2, модели) загружается при первом запросе к камере, а не при старте API
+            from api.cv import gen_video
+
+            stream_options = {
+                'quality': request.args.get('quality', type=int),
+                'fps': request.args.get('fps', type=float),
+                'kbps': request.args.get('kbps', type=int)
+            }
+            if stream_options['quality'] is not None and not 1 <= stream_options['quality'] <= 100:
+                return "Bad request", 400
+
+            camera = Camera.query.get(camera_id if camera_id is not None else CAMERA_ID)
+            if camera is None:
+                if camera_id is not None:
+                    return "Not found", 404
+                # камера по умолчанию из конфигурации
+                return Response(gen_video(CAMERA_ID, None, LOCATION, **stream_options),
+                                mimetype="multipart/x-mixed-replace; boundary=frame")
+            return Response(gen_video(camera.id, camera.source, camera.location, camera.detectors,
+                                      camera.fire_roi, **stream_options),
                             mimetype="multipart/x-mixed-replace; boundary=frame")
         except Exception as e:
             print(e)
             return "Internal server error", 500
 
 
+class CameraStatsAPI(Resource):
+    def get(self, camera_id):
+        """
+        Статистика камеры: кадры, кадры с движением, запуски и пропуски по детекторам, очередь записи клипов
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
+        try:
+            from api.cv import camera_manager
+
+            worker = camera_manager.workers.get(camera_id)
+            if worker is None or worker.stats is None:
+                return "No content", 204
+            return worker.stats, 200
+        except Exception as e:
+            print(e)
+            return "Internal server error", 500
+
+
 class VideoAPI(Resource):
     def get(self, filename):
-        range_header = request.headers.get('Range', None)
-        byte1, byte2 = 0, None
-        if range_header:
-            match = re.search(r'(\d+)-(\d*)', range_header)
-            groups = match.groups()
+        """
+        Клип для плеера: Range (в т.ч. bytes=-N и несколько диапазонов), ETag и Last-Modified,
+        файл отдаётся потоком без чтения диапазона в память
+        """
+        try:
+            path = safe_join(PROJECT_DIR, filename)
+            stat = clip_stat_cache.get(path) if path is not None else None
+            if stat is None:
+                return "Not found", 404
+            return file_response(path, stat, 'video/mp4')
+        except Exception as e:
+            print(e)
+            return "Internal server error", 500
 
-            if groups[0]:
-                byte1 = int(groups[0])
-            if groups[1]:
-                byte2 = int(groups[1])
 
-        chunk, start, length, file_size = get_chunk(filename, byte1, byte2)
-        resp = Response(chunk, 206, mimetype='video/mp4',
-                        content_type='video/mp4', direct_passthrough=True)
-        resp.headers.add('Content-Range', 'bytes {0}-{1}/{2}'.format(start, start + length - 1, file_size))
-        return resp
+class VideoThumbAPI(Resource):
+    def get(self, filename):
+        """
+        Постер клипа (JPEG). Для клипов, записанных до появления индексации, строится при первом запросе
+        """
+        try:
+            path = safe_join(PROJECT_DIR, filename)
+            if path is None:
+                return "Not found", 404
+            thumb = thumb_path(path)
+            stat = clip_stat_cache.get(thumb)
+            if stat is None:
+                if clip_stat_cache.get(path) is None or index_clip(path) is None:
+                    return "Not found", 404
+                stat = os.stat(thumb)
+            return file_response(thumb, stat, 'image/jpeg')
+        except Exception as e:
+            print(e)
+            return "Internal server error", 500
 
 
 class MailAPI(Resource):
@@ -437,22 +649,105 @@ class MailAPI(Resource):
             report_id = request_data.get('report_id')
             recipient_mail = request_data.get('recipient_mail')
 
-            send_mail_with_attachment(report_id, recipient_mail)
-            return "Mail sent", 200
+            job = get_job_queue().enqueue('mail', report_id=report_id, recipient_mail=recipient_mail)
+            return {"job_id": job.id}, 202
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
+
+
+class CreateJobAPI(Resource):
+    def post(self):
+        """
+        Поставить тяжёлую задачу в очередь: {"kind": "report", "report_id": ...}
+        или {"kind": "mail", "report_id": ..., "recipient_mail": ...}
+        :return: Tuple(JSON Object, HTTP Status Code)
+        """
+        try:
+            params = request.get_json(silent=True)
+            if not isinstance(params, dict):
+                return "Bad Request", 400
+            kind = params.pop('kind', None)
+            validate_job(kind, params)
+            if Report.query.get(params['report_id']) is None:
+                return "Not found", 404
+            job = get_job_queue().enqueue(kind, **params)
+            return {"job_id": job.id}, 202
+        except ValueError as e:
+            print(e)
+            return "Bad Request", 400
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
+
+
+class JobAPI(Resource):
+    def get(self, job_id):
+        try:
+            job = Job.query.get(job_id)
+            if job is None:
+                return "Not found", 404
+            res = job.as_dict()
+            res['params'] = json.loads(job.params)
+            return res, 200
         except Exception as e:
             print(e)
             return "Internal Server Error", 500
 
 
+class JobResultAPI(Resource):
+    def get(self, job_id):
+        try:
+            job = Job.query.get(job_id)
+            if job is None:
+                return "Not found", 404
+            if job.status != JobStatus.done or job.result_filename is None:
+                return {"status": job.status}, 409
+            path = os.path.join(JOBS_DIR, job.result_filename)
+            if not os.path.exists(path):
+                return "Gone", 410
+            return send_file(path, mimetype="application/pdf",
+                             as_attachment=True, attachment_filename="gasdnw report.pdf")
+        except Exception as e:
+            print(e)
+            return "Internal Server Error", 500
+
+
+class MetricsAPI(Resource):
+    def get(self):
+        """
+        Метрики в текстовом формате Prometheus: время запросов по маршрутам, число и время SQL запросов,
+        медленные и ошибочные SQL запросы
+        """
+        return Response(exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.before_first_request
+def start_cameras():
+    if CAMERAS_AUTOSTART:
+        from api.cv import camera_manager
+
+        camera_manager.start_all((camera.id, camera.source, camera.location, camera.detectors, camera.fire_roi)
+                                 for camera in Camera.query.all())
+
+
 # Routes
 
 # Routes for sensors
 api.add_resource(MQ2API, '/mq2')
 api.add_resource(DHTAPI, '/dht')
+api.add_resource(MQ2BatchAPI, '/mq2/batch')
+api.add_resource(DHTBatchAPI, '/dht/batch')
 
 api.add_resource(MQ2ListAPI, '/mq2list')
 api.add_resource(DHTListAPI, '/dhtlist')
 
+api.add_resource(MQ2HistoryAPI, '/mq2/history')
+api.add_resource(DHTHistoryAPI, '/dht/history')
+
 api.add_resource(CaseAPI, '/cases/<int:case_id>')
 api.add_resource(LogAPI, '/logs/<int:log_id>')
 api.add_resource(CreateLogAPI, '/logs')
@@ -465,9 +760,17 @@ api.add_resource(CreateReportAPI, '/reports')
 api.add_resource(ReportListAPI, '/reports')
 api.add_resource(GenerateReportAPI, '/report/generate/<int:report_id>')
 
-api.add_resource(CameraAPI, '/camera')
+api.add_resource(CameraAPI, '/camera', '/camera/<int:camera_id>')
+api.add_resource(CameraStatsAPI, '/camera/<int:camera_id>/stats')
 api.add_resource(VideoAPI, '/video/<string:filename>')
+api.add_resource(VideoThumbAPI, '/video/<string:filename>/thumb')
 api.add_resource(MailAPI, '/mail')
 
+api.add_resource(CreateJobAPI, '/jobs')
+api.add_resource(JobAPI, '/jobs/<int:job_id>')
+api.add_resource(JobResultAPI, '/jobs/<int:job_id>/result')
+
+api.add_resource(MetricsAPI, '/metrics')
+
 api.add_resource(SubscriptionAPI, '/subscription')
 api.add_resource(NotificationAPI, '/notification')
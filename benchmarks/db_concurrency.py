@@ -0,0 +1,148 @@
+"""
+Одновременная запись показаний и чтение дашборда на SQLite: настройки по умолчанию против WAL и PRAGMA из config.
+
+    python benchmarks/db_concurrency.py [--writers 4] [--readers 4] [--batch 20] [--seconds 10]
+
+Каждый профиль запускается в отдельном интерпретаторе на новой базе во временном каталоге.
+Писатели шлют пачки в /mq2/batch и /dht/batch, читатели запрашивают /dhtlist, /mq2list и /mq2/history.
+Печатает число запросов в секунду, медиану и p99 задержки, число ошибок (database is locked и т.п.)
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# журнал с откатом и полная синхронизация - поведение SQLite без настроек
+PROFILES = {
+    'default': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_MMAP_SIZE': '-1',
+        'SQLITE_CACHE_SIZE': '-2000',
+        'SQLITE_BUSY_TIMEOUT': '5000'
+    },
+    'tuned': {}
+}
+
+READ_URLS = ['/dhtlist?limit=200', '/mq2list?limit=200', '/mq2/history?max_points=200']
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(latencies, errors, seconds):
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'errors': errors
+    }
+
+
+def run_profile(args):
+    """Тело дочернего процесса: база уже выбрана через переменные окружения"""
+    from api.flask_app import app, db
+    from api.models import Device
+
+    db.create_all()
+    db.session.add(Device(id=1, location='bench'))
+    db.session.commit()
+    db.session.remove()
+    # первый случай создаётся до замера: рассылка уведомлений о нём не относится к базе
+    app.test_client().post('/mq2/batch', json=[{'LPG': 6000, 'CO': 30, 'Smoke': 5, 'device_id': 1}])
+
+    deadline = time.perf_counter() + args.seconds
+    results = {'write': ([], [0]), 'read': ([], [0])}
+    lock = threading.Lock()
+
+    def worker(kind):
+        client = app.test_client()
+        latencies, errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if kind == 'write':
+                mq2 = [{'LPG': 6000 + random.randint(0, 500), 'CO': 30, 'Smoke': 5, 'device_id': 1}
+                       for _ in range(args.batch)]
+                dht = [{'Temperature': 20 + random.randint(0, 5), 'Hudimity': 40, 'device_id': 1}
+                       for _ in range(args.batch)]
+                statuses = [client.post('/mq2/batch', json=mq2).status_code,
+                            client.post('/dht/batch', json=dht).status_code]
+            else:
+                statuses = [client.get(random.choice(READ_URLS)).status_code]
+            elapsed = time.perf_counter() - start
+            if all(status < 500 for status in statuses):
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        with lock:
+            results[kind][0].extend(latencies)
+            results[kind][1][0] += errors
+
+    threads = [threading.Thread(target=worker, args=('write',)) for _ in range(args.writers)]
+    threads += [threading.Thread(target=worker, args=('read',)) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        journal_mode = db.session.execute('PRAGMA journal_mode').scalar()
+    print(json.dumps({
+        'journal_mode': journal_mode,
+        'write': summary(results['write'][0], results['write'][1][0], args.seconds),
+        'read': summary(results['read'][0], results['read'][1][0], args.seconds)
+    }))
+
+
+def spawn_profile(name, args):
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, **PROFILES[name])
+        env['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.sqlite3')
+        env['PYTHONPATH'] = PROJECT_DIR
+        command = [sys.executable, os.path.abspath(__file__), '--child',
+                   '--writers', str(args.writers), '--readers', str(args.readers),
+                   '--batch', str(args.batch), '--seconds', str(args.seconds)]
+        result = subprocess.run(command, cwd=PROJECT_DIR, env=env, stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_profile(args)
+        return
+
+    print(f"{args.writers} writers x {args.batch} readings, {args.readers} readers, {args.seconds:g} s")
+    for name in args.profile or ['default', 'tuned']:
+        result = spawn_profile(name, args)
+        print(f"\n{name} (journal_mode={result['journal_mode']}):")
+        for kind in ('write', 'read'):
+            stats = result[kind]
+            print(f"  {kind:<5} {stats['rps']:8.1f} req/s  p50 {stats['p50_ms']} ms  p99 {stats['p99_ms']} ms"
+                  f"  errors {stats['errors']}")
+
+
+if __name__ == '__main__':
+    main()
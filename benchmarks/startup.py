@@ -0,0 +1,72 @@
+"""
+Время старта API: импорт api.flask_app в чистом интерпретаторе с -X importtime.
+
+    python benchmarks/startup.py [--module api.flask_app] [--runs 5] [--top 15]
+
+Печатает медиану общего времени импорта, время модулей api.* и самые дорогие сторонние модули,
+а также время отложенной инициализации CV (загрузка каскадов и HOG), которую API больше не платит при старте
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """:return: Dict[модуль, Tuple(собственное время, накопленное время)] в микросекундах"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=PROJECT_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def timed_snippet(code):
+    """Время выполнения code в чистом интерпретаторе после импорта api.flask_app, в секундах"""
+    snippet = f"import time, api.flask_app\nt = time.perf_counter()\n{code}\nprint(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', snippet], cwd=PROJECT_DIR, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def median_times(runs):
+    modules = set().union(*runs)
+    return {name: (statistics.median(run.get(name, (0, 0))[0] for run in runs),
+                   statistics.median(run.get(name, (0, 0))[1] for run in runs)) for name in modules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='api.flask_app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    times = median_times([import_times(args.module) for _ in range(args.runs)])
+    print(f"import {args.module}: {times[args.module][1] / 1000:.1f} ms (median of {args.runs})")
+
+    print("\nproject modules (self / cumulative, ms):")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1]):
+        if name.startswith('api.') and name != args.module:
+            print(f"  {name:<30} {self_us / 1000:8.1f} {cumulative_us / 1000:8.1f}")
+
+    print(f"\ntop {args.top} third-party modules by self time (ms):")
+    third_party = [(name, self_us) for name, (self_us, _) in times.items() if not name.startswith('api')]
+    for name, self_us in sorted(third_party, key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<30} {self_us / 1000:8.1f}")
+
+    loaded = [name for name in ('cv2', 'api.cv', 'imutils') if name in times]
+    print(f"\nCV modules imported at startup: {', '.join(loaded) or 'none'}")
+    cv_init = timed_snippet("import api.cv\napi.cv.get_classifiers()")
+    print(f"deferred CV init (import api.cv + classifiers): {cv_init * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# конфигурация читается при импорте api, поэтому окружение задаётся до него
+TEST_DIR = tempfile.mkdtemp(prefix='gasdnw-tests-')
+os.environ.update({
+    'DEBUG': '1',
+    'SECRET_KEY': 'test',
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(TEST_DIR, 'test.sqlite3'),
+    'JOBS_DIR': os.path.join(TEST_DIR, 'jobs'),
+    'REPORT_CACHE_DIR': os.path.join(TEST_DIR, 'reports'),
+    'JOB_WORKERS': '0',
+    'RETENTION_INTERVAL': '0'
+})
+
+from api.flask_app import app, db  # noqa: E402
+from api.cache import mq2_cache, dht_cache  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    """Пустая база на время теста"""
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+        mq2_cache.clear()
+        dht_cache.clear()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
@@ -0,0 +1,161 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+import api.archive
+import api.downsampling
+from api.archive import NO_ID, SensorArchive
+from api.downsampling import epoch_seconds, fetch_columns, load_series, to_epoch
+from api.models import Device, MQ2Data
+from api.rollups import apply_retention
+
+DAY = date(2020, 1, 1)
+NEXT_DAY = date(2020, 1, 2)
+
+
+def add_readings(db, *readings):
+    """readings: Tuple(date_time, lpg) или Tuple(date_time, lpg, case_id)"""
+    rows = [MQ2Data(date_time=reading[0], lpg=reading[1], co=reading[1] + 1, smoke=reading[1] + 2, device_id=1,
+                    case_id=reading[2] if len(reading) > 2 else None) for reading in readings]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+@pytest.fixture
+def readings(database):
+    database.session.add(Device(id=1, location='lab'))
+    database.session.commit()
+    add_readings(database,
+                 (datetime(2020, 1, 1, 10, 0, 0, 500000), 100),
+                 (datetime(2020, 1, 1, 12), 300),
+                 (datetime(2020, 1, 2, 8), 200),
+                 (datetime(2020, 1, 3, 9), 400))
+    return database
+
+
+@pytest.fixture
+def sensor_archive(tmp_path, monkeypatch):
+    sensor_archive = SensorArchive(str(tmp_path))
+    monkeypatch.setattr(api.archive, 'archive', sensor_archive)
+    return sensor_archive
+
+
+def series(model=MQ2Data, **filters):
+    timestamps, values = load_series(model, **filters)
+    return timestamps.tolist(), values['lpg'].tolist()
+
+
+def test_fetch_columns_fills_structured_dtype_in_batches(readings, monkeypatch):
+    monkeypatch.setattr(api.downsampling, 'FETCH_BATCH_SIZE', 3)
+    dtypes = [('date_time', np.int64), ('lpg', np.int32), ('device_id', np.int16)]
+    query = readings.session.query(epoch_seconds(MQ2Data.date_time), MQ2Data.lpg, MQ2Data.device_id) \
+        .order_by(MQ2Data.id)
+
+    columns = fetch_columns(query, dtypes)
+
+    assert list(columns) == ['date_time', 'lpg', 'device_id']
+    assert [column.dtype for column in columns.values()] == [np.int64, np.int32, np.int16]
+    assert all(column.flags['C_CONTIGUOUS'] for column in columns.values())
+    # дробные секунды отброшены, а не округлены
+    assert columns['date_time'].tolist() == to_epoch([datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 12),
+                                                      datetime(2020, 1, 2, 8), datetime(2020, 1, 3, 9)]).tolist()
+    assert columns['lpg'].tolist() == [100, 300, 200, 400]
+
+
+def test_fetch_columns_empty_result(readings):
+    query = readings.session.query(epoch_seconds(MQ2Data.date_time), MQ2Data.lpg).filter(MQ2Data.id < 0)
+
+    columns = fetch_columns(query, [('date_time', np.int64), ('lpg', np.int32)])
+
+    assert columns['date_time'].dtype == np.int64 and len(columns['date_time']) == 0
+    assert columns['lpg'].dtype == np.int32 and len(columns['lpg']) == 0
+
+
+def test_archive_round_trip(readings, sensor_archive):
+    assert sensor_archive.archive(MQ2Data, date(2020, 1, 3)) == [(DAY, 2), (NEXT_DAY, 1)]
+    assert sensor_archive.manifest(MQ2Data) == {'days': {'2020-01-01': 2, '2020-01-02': 1}, 'max_id': 4}
+    assert sensor_archive.days(MQ2Data) == [DAY, NEXT_DAY]
+
+    columns = sensor_archive.load(MQ2Data, DAY)
+    assert {name: column.dtype for name, column in columns.items()} == dict(sensor_archive.dtypes(MQ2Data))
+    assert columns['date_time'].tolist() == to_epoch([datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 12)]).tolist()
+    assert columns['lpg'].tolist() == [100, 300]
+    assert columns['co'].tolist() == [101, 301]
+    assert columns['device_id'].tolist() == [1, 1]
+    assert columns['case_id'].tolist() == [NO_ID, NO_ID]
+
+    filtered = sensor_archive.load(MQ2Data, DAY, date_from=datetime(2020, 1, 1, 11))
+    assert filtered['lpg'].tolist() == [300]
+    assert sensor_archive.load(MQ2Data, DAY, device_id=2)['lpg'].tolist() == []
+
+    # повторная архивация без новых строк ничего не переписывает
+    assert sensor_archive.archive(MQ2Data, date(2020, 1, 3)) == []
+
+
+def test_load_series_merges_archive_and_database(readings, sensor_archive):
+    expected = series()
+    sensor_archive.archive(MQ2Data, date(2020, 1, 3))
+    # строки заархивированных суток удалены из базы, как их удаляет политика хранения
+    MQ2Data.query.filter(MQ2Data.date_time < datetime(2020, 1, 3)).delete()
+    readings.session.commit()
+
+    assert series() == expected
+    assert series(date_from=datetime(2020, 1, 1, 11), date_to=datetime(2020, 1, 3))[1] == [300, 200]
+
+
+def test_backfilled_rows_are_read_from_database_and_merged_into_archive(readings, sensor_archive):
+    sensor_archive.archive(MQ2Data, date(2020, 1, 3))
+    # показание, дописанное задним числом в уже заархивированные сутки
+    add_readings(readings, (datetime(2020, 1, 1, 11), 150))
+
+    timestamps, values = series()
+    assert values == [100, 150, 300, 200, 400]
+    assert timestamps == sorted(timestamps)
+
+    assert sensor_archive.archive(MQ2Data, date(2020, 1, 3)) == [(DAY, 3)]
+    assert sensor_archive.max_id(MQ2Data) == 5
+    assert sensor_archive.load(MQ2Data, DAY)['lpg'].tolist() == [100, 150, 300]
+    assert series()[1] == [100, 150, 300, 200, 400]
+
+
+def test_ids_of_pruned_rows_are_not_reused(readings, sensor_archive):
+    sensor_archive.archive(MQ2Data, date(2020, 1, 4))
+    MQ2Data.query.delete()
+    readings.session.commit()
+    add_readings(readings, (datetime(2020, 1, 1, 11), 150))
+
+    assert series()[1] == [100, 150, 300, 200, 400]
+
+
+def test_merge_keeps_archived_rows_removed_from_database(readings, sensor_archive):
+    sensor_archive.archive(MQ2Data, date(2020, 1, 3))
+    MQ2Data.query.filter(MQ2Data.date_time < datetime(2020, 1, 2)).delete()
+    readings.session.commit()
+    add_readings(readings, (datetime(2020, 1, 1, 13), 350))
+
+    assert sensor_archive.archive(MQ2Data, date(2020, 1, 3)) == [(DAY, 3)]
+    assert sensor_archive.load(MQ2Data, DAY)['lpg'].tolist() == [100, 300, 350]
+
+
+def test_retention_keeps_rows_backfilled_after_archiving(readings, sensor_archive, monkeypatch):
+    import api.config
+
+    monkeypatch.setattr(api.config, 'RAW_RETENTION_DAYS', 1)
+    monkeypatch.setattr(api.archive, 'archive_horizon', lambda: date(2020, 1, 4))
+    archive = sensor_archive.archive
+
+    def archive_then_backfill(model, before):
+        archived = archive(model, before)
+        if model is MQ2Data:
+            # показание дописано между архивацией и удалением
+            add_readings(readings, (datetime(2020, 1, 1, 12, 30), 250))
+        return archived
+
+    monkeypatch.setattr(sensor_archive, 'archive', archive_then_backfill)
+
+    apply_retention()
+
+    assert [row.lpg for row in MQ2Data.query] == [250]
+    assert series()[1] == [100, 300, 250, 200, 400]
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import pytest
+
+from api.detection import FireDetector, group_boxes, merge_windows
+
+OBJECT = (80, 60, 40, 40)
+
+
+class Cascade:
+    """Находит светлый прямоугольник и, как каскад с малым min_neighbors, возвращает несколько близких рамок"""
+
+    def __init__(self):
+        self.scanned = []
+
+    def detectMultiScale(self, gray, scale_factor, min_neighbors):
+        self.scanned.append(gray.shape)
+        points = cv2.findNonZero((gray > 128).astype(np.uint8))
+        if points is None:
+            return ()
+        x, y, w, h = cv2.boundingRect(points)
+        return [(x, y, w, h), (x + 1, y, w, h - 1), (x, y + 1, w - 1, h), (x + 1, y + 1, w - 1, h - 1)]
+
+
+def frame():
+    gray = np.zeros((240, 320), dtype=np.uint8)
+    x, y, w, h = OBJECT
+    gray[y:y + h, x:x + w] = 255
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), gray
+
+
+@pytest.mark.parametrize('coarse_to_fine', [True, False])
+def test_one_object_gives_one_box(coarse_to_fine):
+    cascade = Cascade()
+
+    boxes = FireDetector(cascade, coarse_to_fine=coarse_to_fine)(*frame())
+
+    assert len(boxes) == 1
+    assert np.abs(boxes[0] - OBJECT).max() <= 2
+
+
+def test_overlapping_candidates_are_refined_once():
+    cascade = Cascade()
+
+    FireDetector(cascade)(*frame())
+
+    # грубый проход по уменьшенному вдвое кадру и один точный проход вокруг объекта
+    assert cascade.scanned[0] == (120, 160)
+    assert len(cascade.scanned) == 2
+
+
+def test_overlapping_rois_give_one_box():
+    rois = [[0, 0, 0.5, 0.5], [0.1, 0.1, 0.5, 0.5]]
+
+    boxes = FireDetector(Cascade(), rois=rois, coarse_to_fine=False)(*frame())
+
+    assert len(boxes) == 1
+
+
+def test_merge_windows():
+    # третье окно связывает первые два, которые сами не пересекаются
+    assert merge_windows([(0, 0, 10, 10), (30, 0, 40, 10), (8, 0, 32, 10)]) == [[0, 0, 40, 10]]
+    assert merge_windows([(0, 0, 10, 10), (10, 0, 20, 10)]) == [[0, 0, 10, 10], [10, 0, 20, 10]]
+
+
+def test_group_boxes_keeps_separate_objects():
+    boxes = group_boxes([(0, 0, 10, 10), (1, 0, 10, 10), (100, 100, 10, 10)])
+
+    assert sorted(map(tuple, boxes)) == [(0, 0, 10, 10), (100, 100, 10, 10)]
@@ -0,0 +1,26 @@
+import numpy as np
+
+from api.encoding import ClientStream, EncodedFrameCache, MULTIPART_HEADER, MULTIPART_TRAILER
+
+
+def frames(count):
+    return [(seq, np.full((48, 64, 3), seq * 10, dtype=np.uint8)) for seq in range(1, count + 1)]
+
+
+def test_stream_yields_header_jpeg_and_trailer_chunks():
+    chunks = list(ClientStream(EncodedFrameCache(), use_turbo=False).stream(frames(2)))
+
+    assert len(chunks) == 6
+    assert all(type(chunk) is bytes for chunk in chunks)
+    for header, jpeg, trailer in (chunks[:3], chunks[3:]):
+        assert header == MULTIPART_HEADER % len(jpeg)
+        assert jpeg[:2] == b'\xff\xd8'
+        assert trailer == MULTIPART_TRAILER
+
+
+def test_clients_with_same_quality_share_encoded_frame():
+    cache = EncodedFrameCache()
+    first = list(ClientStream(cache, use_turbo=False).stream(frames(1)))
+    second = list(ClientStream(cache, use_turbo=False).stream(frames(1)))
+
+    assert first[1] is second[1]
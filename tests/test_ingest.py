@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import api.ingest
+from api.flask_app import app
+from api.models import Case, DHTData, Device, MQ2Data
+
+START = datetime(2020, 1, 1, 12)
+
+
+def reading(seconds, lpg=6000, device_id=1):
+    return {'LPG': lpg, 'CO': 1, 'Smoke': 1, 'device_id': device_id,
+            'date_time': (START + timedelta(seconds=seconds)).isoformat()}
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    database.session.add(Device(id=1, location='kitchen'))
+    database.session.commit()
+    client = app.test_client()
+    client.notifications = []
+    monkeypatch.setattr(api.ingest, 'notify_about_warning', client.notifications.append)
+    return client
+
+
+def post_mq2(client, readings):
+    response = client.post('/mq2/batch', json=readings)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def case_seconds():
+    """Случаи показаний MQ2 по порядку времени: List[List[секунды от START]]"""
+    cases = {}
+    for row in MQ2Data.query.order_by(MQ2Data.date_time):
+        cases.setdefault(row.case_id, []).append(int((row.date_time - START).total_seconds()))
+    return list(cases.values())
+
+
+def test_readings_below_thresholds_are_not_stored(client):
+    assert post_mq2(client, [reading(0, lpg=100)]) == {'inserted': 0, 'cases': []}
+    assert MQ2Data.query.count() == 0
+
+
+def test_cases_are_split_on_gaps_in_time_order(client):
+    result = post_mq2(client, [reading(20), reading(100), reading(0), reading(120, lpg=100)])
+
+    assert result['inserted'] == 3
+    assert len(result['cases']) == 2
+    assert case_seconds() == [[0, 20], [100]]
+    assert len(client.notifications) == 2
+
+
+def test_buffered_older_batch_gets_its_own_case(client):
+    post_mq2(client, [reading(3600)])
+
+    result = post_mq2(client, [reading(10), reading(0)])
+
+    assert len(result['cases']) == 1
+    assert case_seconds() == [[0, 10], [3600]]
+
+
+def test_batch_continuing_the_last_case(client):
+    post_mq2(client, [reading(0)])
+
+    assert post_mq2(client, [reading(15), reading(40)])['cases'] == []
+    assert case_seconds() == [[0, 15, 40]]
+    assert Case.query.count() == 1
+
+
+def test_notification_error_does_not_fail_stored_batch(client, monkeypatch):
+    def fail(message):
+        raise FileNotFoundError('private_key.pem')
+
+    monkeypatch.setattr(api.ingest, 'notify_about_warning', fail)
+
+    result = post_mq2(client, [reading(0)])
+
+    assert result['inserted'] == 1
+    assert MQ2Data.query.count() == 1
+
+
+def test_dht_batch(client):
+    response = client.post('/dht/batch', json=[
+        {'Temperature': 21, 'Hudimity': 40, 'device_id': 1, 'date_time': (START + timedelta(seconds=5)).isoformat()},
+        {'Temperature': 20, 'Hudimity': 41, 'device_id': 1, 'date_time': START.isoformat()}
+    ])
+
+    assert response.status_code == 200
+    assert response.get_json() == {'inserted': 2}
+    assert [row.temp for row in DHTData.query.order_by(DHTData.date_time)] == [20, 21]
+    assert client.get('/dht?device_id=1').get_json()['temp'] == 21
@@ -0,0 +1,61 @@
+import pytest
+
+from api.flask_app import app, db
+from api.jobs import JobQueue
+from api.models import Job, Report
+
+
+@pytest.fixture
+def client(database):
+    database.session.add(Report(id=1, content='report'))
+    database.session.commit()
+    return app.test_client()
+
+
+@pytest.mark.parametrize('body', [
+    {'kind': 'unknown', 'report_id': 1},
+    {'kind': 'report'},
+    {'kind': 'report', 'report_id': '1'},
+    {'kind': 'report', 'report_id': 1, 'extra': True},
+    {'kind': 'mail', 'report_id': 1},
+    {'kind': 'mail', 'report_id': 1, 'recipient_mail': 'nobody'},
+    [1, 2],
+])
+def test_create_job_rejects_invalid_params(client, body):
+    assert client.post('/jobs', json=body).status_code == 400
+    assert Job.query.count() == 0
+
+
+def test_create_job(client):
+    response = client.post('/jobs', json={'kind': 'mail', 'report_id': 1, 'recipient_mail': 'a@example.com'})
+
+    assert response.status_code == 202
+    job = Job.query.get(response.get_json()['job_id'])
+    assert job.kind == 'mail'
+
+
+def test_create_job_for_missing_report(client):
+    assert client.post('/jobs', json={'kind': 'report', 'report_id': 2}).status_code == 404
+
+
+def test_start_without_workers_does_not_touch_database(monkeypatch):
+    queue = JobQueue(app, workers=0)
+    monkeypatch.setattr(queue, 'requeue_stale', lambda: pytest.fail('requeue_stale called'))
+
+    queue.start()
+
+    assert queue.threads == []
+
+
+def test_start_survives_database_errors(monkeypatch):
+    queue = JobQueue(app, workers=1, poll_interval=60)
+    monkeypatch.setattr(queue, 'work', lambda: None)
+
+    def requeue_stale():
+        db.session.execute('SELECT * FROM missing_table')
+
+    monkeypatch.setattr(queue, 'requeue_stale', requeue_stale)
+
+    queue.start()
+
+    assert len(queue.threads) == 1
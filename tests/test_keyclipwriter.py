@@ -0,0 +1,76 @@
+from threading import Event
+
+import cv2
+import numpy as np
+
+from api.keyclipwriter import KeyClipWriter
+
+FOURCC = cv2.VideoWriter_fourcc(*'MJPG')
+
+
+def frame(value):
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+
+def frame_count(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        count = 0
+        while capture.read()[0]:
+            count += 1
+        return count
+    finally:
+        capture.release()
+
+
+def test_segment_with_all_frames_dropped_is_released(tmp_path):
+    finished = []
+    kcw = KeyClipWriter(bufSize=4, timeout=0.1, queueSize=2, onFinish=finished.append)
+    # поток записи стоит, пока очередь переполняется
+    stalled = Event()
+    write_frame = kcw.writeFrame
+
+    def stalled_write(frame, writer):
+        stalled.wait(5)
+        write_frame(frame, writer)
+
+    kcw.writeFrame = stalled_write
+
+    paths = [str(tmp_path / name) for name in ('a.avi', 'b.avi', 'c.avi')]
+    for i in range(4):
+        kcw.update(frame(i))
+    kcw.start(paths[0], FOURCC, 10)
+    kcw.rotate(paths[1], FOURCC, 10)
+    for i in range(2):
+        kcw.update(frame(10 + i))
+    kcw.rotate(paths[2], FOURCC, 10)
+    for i in range(5):
+        kcw.update(frame(20 + i))
+    kcw.finish()
+
+    stalled.set()
+    kcw.thread.join(5)
+
+    assert not kcw.thread.is_alive()
+    assert finished == paths
+    assert kcw.outputs == {}
+    assert kcw.dropped > 0
+    assert all(frame_count(path) > 0 for path in paths)
+
+
+def test_rotated_segments_are_released_in_order(tmp_path):
+    finished = []
+    kcw = KeyClipWriter(bufSize=4, timeout=0.1, queueSize=16, onFinish=finished.append)
+    paths = [str(tmp_path / name) for name in ('a.avi', 'b.avi')]
+
+    kcw.update(frame(0))
+    kcw.start(paths[0], FOURCC, 10)
+    kcw.update(frame(1))
+    kcw.rotate(paths[1], FOURCC, 10)
+    kcw.update(frame(2))
+    kcw.update(frame(3))
+    kcw.finish()
+    kcw.thread.join(5)
+
+    assert finished == paths
+    assert [frame_count(path) for path in paths] == [2, 2]
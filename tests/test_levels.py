@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from api.levels import DEFAULT_THRESHOLDS, ThresholdTable
+from api.utils import know_level
+
+# уровни на порогах и сразу под ними: значение, равное порогу, уже относится к следующему уровню
+BOUNDARIES = [
+    (gas, threshold + delta, level + (delta == 0))
+    for gas, thresholds in DEFAULT_THRESHOLDS.items()
+    for level, threshold in enumerate(thresholds)
+    for delta in (-0.5, 0)
+]
+
+DEVICE_CO = (1, 2, 3, 4)
+
+
+def table():
+    return ThresholdTable(devices={'7': {'co': DEVICE_CO}})
+
+
+@pytest.mark.parametrize('gas, value, level', BOUNDARIES)
+def test_scalar_level_on_thresholds(gas, value, level):
+    assert know_level(value, *DEFAULT_THRESHOLDS[gas]) == level
+    assert table().level(gas, value) == level
+
+
+@pytest.mark.parametrize('gas, value, level', BOUNDARIES)
+def test_array_level_on_thresholds(gas, value, level):
+    assert table().classify(gas, [value]).tolist() == [level]
+
+
+def test_array_levels_match_scalar():
+    for gas, thresholds in DEFAULT_THRESHOLDS.items():
+        values = [0, *thresholds, *(t - 0.5 for t in thresholds), thresholds[-1] * 10]
+        assert table().classify(gas, values).tolist() == [know_level(v, *thresholds) for v in values]
+
+
+def test_missing_values_are_level_zero():
+    assert table().level('co', None) == 0
+    assert table().classify('co', [np.nan, 10]).tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('value, level', [(0.5, 0), (1, 1), (2, 2), (2.5, 2), (3, 3), (4, 4), (10, 4)])
+def test_device_override_on_thresholds(value, level):
+    thresholds = table()
+    assert thresholds.level('co', value, 7) == level
+    assert thresholds.classify('co', [value], 7).tolist() == [level]
+    assert thresholds.check(0, value, 0, 7) == level
+    assert thresholds.check(0, value, 0) == know_level(value, *DEFAULT_THRESHOLDS['co'])
+    # остальные газы устройства берут пороги по умолчанию
+    assert thresholds.level('smoke', value, 7) == know_level(value, *DEFAULT_THRESHOLDS['smoke'])
+
+
+def test_batch_applies_device_overrides():
+    co = [1, 10, 4, 400, 9.5]
+    device_ids = [7, 7, 1, 1, None]
+    levels = table().check_batch(np.zeros(5), co, np.zeros(5), device_ids)
+    assert levels.tolist() == [1, 4, 0, 4, 0]
+    assert levels.tolist() == [table().check(0, c, 0, d) for c, d in zip(co, device_ids)]
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from api.flask_app import app
+from api.models import Camera, Case, Device, Log, MQ2Data, Report
+from api.utils import LevelType
+
+
+@pytest.fixture
+def places(database):
+    database.session.add_all([Device(id=1, location='kitchen'), Camera(id=1, location='hall')])
+    database.session.commit()
+    return database
+
+
+def seed(db, count):
+    """Ещё count случаев с показаниями, count записей журнала и по отчёту на каждый"""
+    start = datetime(2020, 1, 1) + timedelta(minutes=Case.query.count())
+    for i in range(count):
+        date_time = start + timedelta(minutes=i)
+        case = Case(date_time=date_time, note='gas', level=LevelType.dangerous)
+        log = Log(date_time=date_time, camera_id=1, recognized_objects='fire')
+        db.session.add_all([case, log])
+        db.session.flush()
+        db.session.add_all([MQ2Data(date_time=date_time, lpg=6000, co=30, smoke=5, device_id=1, case_id=case.id),
+                            Report(created_at=date_time, content='case', case_id=case.id),
+                            Report(created_at=date_time, content='log', log_id=log.id)])
+    db.session.commit()
+
+
+@pytest.fixture
+def statements():
+    """Счётчик SQL запросов, выполненных через движок"""
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = app.extensions['sqlalchemy'].db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+def count_statements(client, statements, url):
+    del statements[:]
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('url', ['/reports', '/logs', '/reports?limit=100', '/logs?limit=100'])
+def test_list_query_count_does_not_grow_with_rows(places, statements, url):
+    client = app.test_client()
+    client.get('/cases')  # before_first_request
+    per_row = 2 if url.startswith('/reports') else 1
+
+    seed(places, 3)
+    few, rows = count_statements(client, statements, url)
+    assert len(rows) == 3 * per_row
+
+    seed(places, 30)
+    many, rows = count_statements(client, statements, url)
+    assert len(rows) == 33 * per_row
+
+    assert few == many == 1
+
+
+def test_report_list_fields(places):
+    seed(places, 1)
+    rows = app.test_client().get('/reports').get_json()
+
+    by_content = {row['content']: row for row in rows}
+    assert by_content['case']['device_location'] == 'kitchen'
+    assert by_content['case']['case_level'] == 'dangerous'
+    assert by_content['log']['camera_location'] == 'hall'
+    assert 'device_location' not in by_content['log']
@@ -0,0 +1,130 @@
+import base64
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+import api.push
+from api.flask_app import app
+from api.models import Subscriber
+from api.push import PushDispatcher
+from api.utils import notify_about_warning
+
+BACKOFF = 0.05
+RETRIES = 2
+
+
+class PushService(BaseHTTPRequestHandler):
+    """
+    Сервис рассылки: статус ответа задаётся путём, /flaky отвечает 503 на первые две попытки,
+    /slow ждёт server.release
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests.setdefault(self.path, []).append(time.monotonic())
+            attempt = len(self.server.requests[self.path])
+        if self.path == '/slow':
+            self.server.release.wait(5)
+        status = {'/ok': 201, '/slow': 201, '/missing': 404, '/gone': 410, '/down': 500,
+                  '/flaky': 503 if attempt <= 2 else 201}[self.path]
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Signer:
+    def headers(self, endpoint):
+        return {'Authorization': 'vapid t=test, k=test'}
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+@pytest.fixture
+def push_service():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PushService)
+    server.lock = Lock()
+    server.requests = {}
+    server.release = Event()
+    thread = Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    dispatcher = PushDispatcher(app, Signer(), max_workers=4, timeout=5, retries=RETRIES, backoff=BACKOFF)
+    monkeypatch.setattr(api.push, 'dispatcher', dispatcher)
+    yield dispatcher
+    dispatcher.shutdown(wait=False)
+
+
+def subscribe(db, push_service, *paths):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    p256dh = b64(key.public_key().public_bytes(Encoding.X962, PublicFormat.UncompressedPoint))
+    host, port = push_service.server_address
+    db.session.add_all([Subscriber(endpoint=f"http://{host}:{port}{path}", p256dh=p256dh, auth=b64(os.urandom(16)))
+                        for path in paths])
+    db.session.commit()
+
+
+def subscribed_paths(db):
+    db.session.rollback()
+    return sorted(subscriber.endpoint.rsplit('/', 1)[1] for subscriber in Subscriber.query)
+
+
+def statuses(futures):
+    return sorted(future.result(timeout=5) for future in futures)
+
+
+def test_retries_with_exponential_backoff(database, push_service, dispatcher):
+    subscribe(database, push_service, '/flaky')
+
+    assert statuses(notify_about_warning('{}')) == [201]
+
+    first, second, third = push_service.requests['/flaky']
+    assert second - first >= BACKOFF
+    assert third - second >= 2 * BACKOFF
+
+
+def test_gives_up_after_retries(database, push_service, dispatcher):
+    subscribe(database, push_service, '/down')
+
+    assert statuses(notify_about_warning('{}')) == [500]
+
+    assert len(push_service.requests['/down']) == RETRIES + 1
+    assert subscribed_paths(database) == ['down']
+
+
+def test_expired_subscriptions_are_removed(database, push_service, dispatcher):
+    subscribe(database, push_service, '/ok', '/missing', '/gone')
+
+    assert statuses(notify_about_warning('{}')) == [201, 404, 410]
+
+    assert subscribed_paths(database) == ['ok']
+    assert len(push_service.requests['/missing']) == len(push_service.requests['/gone']) == 1
+
+
+def test_notify_returns_before_delivery(database, push_service, dispatcher):
+    subscribe(database, push_service, '/slow', '/slow')
+
+    futures = notify_about_warning('{}')
+
+    assert len(futures) == 2
+    assert not any(future.done() for future in futures)
+    push_service.release.set()
+    assert statuses(futures) == [201, 201]
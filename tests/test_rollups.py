@@ -0,0 +1,68 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import api.archive
+import api.config
+from api.archive import SensorArchive
+from api.models import Device, MQ2Data, MQ2Rollup
+from api.rollups import rebuild_rollups
+
+
+def day_rollups():
+    rows = MQ2Rollup.query.filter_by(resolution=86400).order_by(MQ2Rollup.bucket, MQ2Rollup.device_id)
+    return [(row.bucket, row.device_id, row.count, row.lpg_min, row.lpg_max, row.lpg_sum) for row in rows]
+
+
+@pytest.fixture
+def readings(database):
+    database.session.add(Device(id=1, location='lab'))
+    database.session.add_all([MQ2Data(date_time=date_time, lpg=lpg, co=1, smoke=1, device_id=device_id)
+                              for date_time, lpg, device_id in ((datetime(2020, 1, 1, 10), 100, 1),
+                                                                (datetime(2020, 1, 1, 11), 300, None),
+                                                                (datetime(2020, 1, 2, 8), 200, 1))])
+    database.session.commit()
+    return database
+
+
+def prune_raw(db, before):
+    MQ2Data.query.filter(MQ2Data.date_time < before).delete()
+    db.session.commit()
+
+
+def test_rebuild_from_raw_rows(readings):
+    rebuild_rollups(MQ2Data)
+
+    assert day_rollups() == [(datetime(2020, 1, 1), 0, 1, 300, 300, 300),
+                             (datetime(2020, 1, 1), 1, 1, 100, 100, 100),
+                             (datetime(2020, 1, 2), 1, 1, 200, 200, 200)]
+
+
+def test_rebuild_reads_archived_days(readings, tmp_path, monkeypatch):
+    sensor_archive = SensorArchive(str(tmp_path))
+    monkeypatch.setattr(api.archive, 'archive', sensor_archive)
+    rebuild_rollups(MQ2Data)
+    expected = day_rollups()
+    sensor_archive.archive(MQ2Data, date(2020, 1, 3))
+    prune_raw(readings, datetime(2020, 1, 3))
+    # показание, дописанное после архивации, берётся из базы
+    readings.session.add(MQ2Data(date_time=datetime(2020, 1, 2, 9), lpg=400, co=1, smoke=1, device_id=1))
+    readings.session.commit()
+
+    rebuild_rollups(MQ2Data)
+
+    assert day_rollups() == expected[:2] + [(datetime(2020, 1, 2), 1, 2, 200, 400, 600)]
+
+
+def test_rebuild_keeps_rollups_of_pruned_days(readings, monkeypatch):
+    rebuild_rollups(MQ2Data)
+    expected = day_rollups()
+    prune_raw(readings, datetime(2020, 1, 2))
+    monkeypatch.setattr(api.config, 'RAW_RETENTION_DAYS', 30)
+    recent = datetime.combine(date.today(), datetime.min.time())
+    readings.session.add(MQ2Data(date_time=recent + timedelta(hours=1), lpg=500, co=1, smoke=1, device_id=1))
+    readings.session.commit()
+
+    rebuild_rollups(MQ2Data)
+
+    assert day_rollups() == expected + [(recent, 1, 1, 500, 500, 500)]
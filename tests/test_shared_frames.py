@@ -0,0 +1,78 @@
+import multiprocessing
+
+import numpy as np
+
+from api.shared_frames import SharedFrameReader, SharedFrameWriter
+
+
+def frame(value, shape=(4, 6, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def write_frames(queue, count):
+    writer = SharedFrameWriter(slots=4)
+    try:
+        for i in range(count):
+            queue.put(writer.write(frame(i)))
+        queue.get()  # ждём, пока родитель прочитает кадры
+    finally:
+        writer.close()
+
+
+def test_frames_cross_process_boundary_through_shared_memory():
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=write_frames, args=(queue, 3))
+    process.start()
+    reader = SharedFrameReader()
+    try:
+        frames = [reader.read(queue.get(timeout=30)) for _ in range(3)]
+        assert [f[0, 0, 0] for f in frames] == [0, 1, 2]
+        assert all(f.shape == (4, 6, 3) and f.dtype == np.uint8 for f in frames)
+    finally:
+        reader.close()
+        queue.put(None)
+        process.join(30)
+
+
+def test_overwritten_slot_is_skipped():
+    writer = SharedFrameWriter(slots=2)
+    reader = SharedFrameReader()
+    try:
+        first = writer.write(frame(1))
+        writer.write(frame(2))
+        writer.write(frame(3))  # тот же слот, что у первого кадра
+
+        assert reader.read(first) is None
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_read_returns_a_copy():
+    writer = SharedFrameWriter(slots=2)
+    reader = SharedFrameReader()
+    try:
+        copy = reader.read(writer.write(frame(1)))
+        writer.write(frame(2))
+        writer.write(frame(3))
+
+        assert copy[0, 0, 0] == 1
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_larger_frame_reallocates_and_old_block_is_gone():
+    writer = SharedFrameWriter(slots=2)
+    reader = SharedFrameReader()
+    try:
+        small = writer.write(frame(1))
+        large = writer.write(frame(2, shape=(8, 12, 3)))
+
+        assert large[0] != small[0]
+        assert reader.read(large).shape == (8, 12, 3)
+        assert reader.read(small) is None
+    finally:
+        reader.close()
+        writer.close()
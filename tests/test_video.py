@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from api.flask_app import app
+from api.video import file_response, parse_range_header
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def get(path, range_header):
+    headers = {'Range': range_header} if range_header is not None else {}
+    with app.test_request_context(headers=headers):
+        response = file_response(path, os.stat(path), 'video/mp4')
+        response.direct_passthrough = False
+        return response.status_code, response.headers, response.get_data()
+
+
+@pytest.mark.parametrize('value', ['bytes=abc', 'bytes=5', 'bytes=1-x', 'bytes=9-3', 'items=0-5', 'bytes=0-1,abc', ''])
+def test_invalid_range_is_ignored(video, value):
+    assert parse_range_header(value) is None
+    status, headers, body = get(video, value)
+    assert status == 200
+    assert body == DATA
+    assert 'Content-Range' not in headers
+
+
+def test_without_range_whole_file(video):
+    status, _, body = get(video, None)
+    assert status == 200
+    assert body == DATA
+
+
+@pytest.mark.parametrize('value, start, stop', [('bytes=0-9', 0, 10), ('bytes=1000-', 1000, 1024),
+                                                ('bytes=-4', 1020, 1024), ('bytes=0-1,2-5', 0, 6)])
+def test_satisfiable_range(video, value, start, stop):
+    status, headers, body = get(video, value)
+    assert status == 206
+    assert headers['Content-Range'] == f"bytes {start}-{stop - 1}/{len(DATA)}"
+    assert body == DATA[start:stop]
+
+
+def test_multiple_ranges(video):
+    status, headers, body = get(video, 'bytes=0-1,10-11')
+    assert status == 206
+    assert headers['Content-Type'].startswith('multipart/byteranges')
+    assert int(headers['Content-Length']) == len(body)
+    assert DATA[0:2] in body and DATA[10:12] in body
+
+
+@pytest.mark.parametrize('value', ['bytes=2000-', 'bytes=2000-3000', 'bytes=2000-2001,3000-3001'])
+def test_unsatisfiable_range(video, value):
+    status, headers, _ = get(video, value)
+    assert status == 416
+    assert headers['Content-Range'] == f"bytes */{len(DATA)}"